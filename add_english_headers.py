@@ -1,13 +1,28 @@
+import argparse
+import hashlib
 import json
-import os
+from concurrent.futures import ThreadPoolExecutor
+
 import openai
 
-# OpenAI API Client
-client = openai.OpenAI()
+import checkpoint_journal
+from batch_requests import batch_line, load_batch_results, write_batch_file
+from incremental import PriorResults, load_previous_output
+from labels import label_record, write_labels
+from llm_cache import LLMCache
+from llm_scheduler import InvalidResponse, RequestScheduler, RetryBudgetExhausted, dead_letter_path
+from metrics import metrics
 
-def generate_section_summary(sections):
+# OpenAI API Client; retries are handled by the scheduler
+client = openai.OpenAI(max_retries=0)
+cache = LLMCache()  # Summaries already paid for, reused across runs
+scheduler = RequestScheduler(requests_per_minute=500, tokens_per_minute=200_000)
+
+SUMMARY_MODEL = "gpt-4o-mini"
+
+def build_summary_messages(sections):
     """
-    Calls OpenAI API to generate a concise summary of the sections.
+    Builds the chat messages asking for a concise summary of the sections.
     """
     prompt = f"""Given the following list of section titles, summarize them in a concise format while preserving all key details. 
     Structure the summary as follows:
@@ -28,74 +43,261 @@ def generate_section_summary(sections):
     Now, generate the structured summary for the following section titles:
     {'; '.join(sections)}
     """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an assistant that formats section titles into structured summaries."},
-            {"role": "user", "content": prompt}
-        ]
+    return [
+        {"role": "system", "content": "You are an assistant that formats section titles into structured summaries."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_section_summary(sections):
+    """
+    Calls OpenAI API to generate a concise summary of the sections.
+    Raises RetryBudgetExhausted if the scheduler gives up on the request.
+    """
+    messages = build_summary_messages(sections)
+    cached = cache.get(SUMMARY_MODEL, None, messages)
+    if cached is not None:
+        return cached
+
+    def request():
+        return client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=messages
+        )
+
+    def validate(response):
+        summary = (response.choices[0].message.content or "").strip()
+        if not summary:
+            raise InvalidResponse("Empty summary received")
+        cache.put(SUMMARY_MODEL, None, messages, summary)
+        return summary
+
+    return scheduler.call(request, messages, key={"sections": list(sections)}, validate=validate,
+                          completion_tokens=200)
+
+def save_chunk(journal, index, chunk, fill=False):
+    """
+    Saves a newly processed chunk progressively by appending it to the output file's journal.
+    fill marks a chunk retried in a gap below the journal's tail.
+    """
+    journal.append(index, chunk, fill)
+    print(f"Progress saved: Chunk #{chunk['metadata']['chunk_number']} journaled")
+
+def get_last_saved_index(output_file):
+    """
+    Determines the last processed chunk index to resume from, reading only the journal tail.
+    """
+    resume_index, _ = checkpoint_journal.read_tail(checkpoint_journal.journal_path(output_file))
+    return resume_index
+
+def get_pending_indices(output_file, chunk_count):
+    """
+    Returns the chunk indices still to process, and the resume index: chunks left out of an
+    earlier run because their summary was dead-lettered come first, then every chunk after the tail.
+    """
+    resume_index = get_last_saved_index(output_file)
+    missing = checkpoint_journal.missing_indices(checkpoint_journal.journal_path(output_file))
+    if missing:
+        print(f"🔁 Retrying {len(missing)} chunks missing from an earlier run")
+    return missing + list(range(resume_index, chunk_count)), resume_index
+
+def summarize_unique_sections(chunks, max_workers=8):
+    """
+    Generates one summary per distinct section list instead of one per chunk.
+    Consecutive chunks usually share the same sections, so this is far fewer API calls.
+    Returns a dict mapping tuple(sections) to its summary, or None if the request was dead-lettered.
+    """
+    unique_sections = list(dict.fromkeys(
+        tuple(chunk.get("metadata", {}).get("sections", [])) for chunk in chunks
+    ))
+    unique_sections = [sections for sections in unique_sections if sections]
+    print(f"🧮 {len(chunks)} chunks share {len(unique_sections)} unique section sets")
+
+    def summarize(sections):
+        try:
+            return generate_section_summary(list(sections))
+        except RetryBudgetExhausted:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(unique_sections, executor.map(summarize, unique_sections)))
+
+def prior_summaries(previous_output):
+    """
+    Indexes a previous output by chunk id and section list, so chunks whose text and sections
+    are unchanged keep their summarized text without another request.
+    """
+    return PriorResults(
+        load_previous_output(previous_output),
+        lambda chunk: tuple(chunk.get("metadata", {}).get("sections", [])) or None,
     )
-    
-    return response.choices[0].message.content.strip()
-
-def save_chunk(output_file, chunk):
-    """
-    Saves a newly processed chunk progressively by appending it to the output file.
-    """
-    if os.path.exists(output_file):
-        with open(output_file, "r+", encoding="utf-8") as f:
-            try:
-                classified_chunks = json.load(f)
-            except json.JSONDecodeError:
-                classified_chunks = []
-            classified_chunks.append(chunk)
-            f.seek(0)  # Move to start of file
-            json.dump(classified_chunks, f, indent=2, ensure_ascii=False)
-            f.truncate()  # Remove any leftover data
+
+def process_chunks(input_file, output_file, max_workers=8, previous_output=None):
+    """
+    Reads chunks from input JSON, summarizes each distinct section list once, then prepends the
+    summaries to the chunk texts in a single pass, saving each processed chunk immediately.
+    With previous_output, chunks carried forward from that file are not summarized again.
+    """
+    metrics.record_file(input_file, "read")
+    with metrics.stage("load_chunks"), open(input_file, "r", encoding="utf-8") as infile:
+        chunks = json.load(infile)
+
+    journal = checkpoint_journal.open_journal(output_file)  # Seeds from a pre-journal output file if needed
+    pending_indices, last_saved_index = get_pending_indices(output_file, len(chunks))
+    prior = prior_summaries(previous_output) if previous_output else None
+
+    try:
+        carried = {}
+        if prior is not None:
+            for i in pending_indices:
+                chunk = chunks[i]
+                sections = tuple(chunk.get("metadata", {}).get("sections", []))
+                previous = prior.get(chunk["id"], sections) if sections else None
+                if previous is not None:
+                    carried[i] = previous["text"]
+            prior.report()
+
+        # Generate section summaries using OpenAI, several at a time
+        remaining = [chunks[i] for i in pending_indices if i not in carried]
+        with metrics.stage("summarize"):
+            summaries = summarize_unique_sections(remaining, max_workers)
+
+        for i in pending_indices:
+            chunk = chunks[i]
+            metadata = chunk.get("metadata", {})
+            sections = metadata.get("sections", [])
+            if i in carried:
+                chunk["text"] = carried[i]  # Already summarized in the previous output
+            elif sections:
+                summary = summaries[tuple(sections)]
+                if summary is None:
+                    continue  # Dead-lettered; left out of the output
+                # Prepend summary and a separator (two newlines) to the chunk's text
+                chunk["text"] = f"{summary}\n\n{chunk['text']}"
+
+            chunk["metadata"]["chunk_number"] = i + 1  # Ensure chunk number is accurate
+            save_chunk(journal, i, chunk, fill=i < last_saved_index)  # Save each chunk progressively
+    finally:
+        # Compact the journal into the final JSON array, even if the run was interrupted
+        journal.close()
+        with metrics.stage("compact"):
+            checkpoint_journal.compact(output_file, indent=2, ensure_ascii=False)
+        cache.report()
+        scheduler.report()
+        scheduler.write_dead_letters(dead_letter_path(output_file))
+
+    if scheduler.dead_letters:
+        print(f"\n⚠️ {len(scheduler.dead_letters)} summaries were dead-lettered and their chunks are missing from "
+              f"{output_file}; run again to retry them.")
     else:
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump([chunk], f, indent=2, ensure_ascii=False)
+        print(f"\nAll chunks processed and saved in {output_file}")
+
+def write_summary_labels(input_file, labels_file, max_workers=8):
+    """
+    Writes a label sidecar (chunk id, sections, summary) instead of a full copy of the catalog;
+    labels.iter_labeled_chunks composes the summarized text from catalog.json on demand.
+    """
+    metrics.record_file(input_file, "read")
+    with metrics.stage("load_chunks"), open(input_file, "r", encoding="utf-8") as infile:
+        chunks = json.load(infile)
 
-    print(f"Progress saved: Chunk #{chunk['metadata']['chunk_number']} added to {output_file}")
+    try:
+        with metrics.stage("summarize"):
+            summaries = summarize_unique_sections(chunks, max_workers)
+        records = (
+            label_record(chunk, summaries.get(tuple(chunk.get("metadata", {}).get("sections", []))))
+            for chunk in chunks
+        )
+        # Chunks whose summary was dead-lettered are left out, as in process_chunks
+        return write_labels(labels_file, (
+            record for record in records if "summary" in record or not record["sections"]
+        ))
+    finally:
+        cache.report()
+        scheduler.report()
+        scheduler.write_dead_letters(dead_letter_path(labels_file))
 
-def get_last_saved_index(output_file):
+def summary_custom_id(sections):
+    """
+    Batch custom_id for a section list. Chunks with identical sections share one request.
+    """
+    digest = hashlib.sha256("\n".join(sections).encode("utf-8")).hexdigest()
+    return f"summary-{digest[:32]}"
+
+def build_summary_batch(input_file, batch_file, sections_filter=None):
     """
-    Determines the last processed chunk index to resume from.
+    Writes an OpenAI Batch API request file with one summary request per distinct section list.
     """
-    if os.path.exists(output_file):
-        with open(output_file, "r", encoding="utf-8") as f:
-            try:
-                classified_chunks = json.load(f)
-                if classified_chunks:
-                    return len(classified_chunks)  # Resume from the next chunk
-            except json.JSONDecodeError:
-                return 0
-    return 0  # Start from the beginning
+    metrics.record_file(input_file, "read")
+    with metrics.stage("load_chunks"), open(input_file, "r", encoding="utf-8") as infile:
+        chunks = json.load(infile)
+
+    unique_sections = dict.fromkeys(tuple(chunk.get("metadata", {}).get("sections", [])) for chunk in chunks)
+    lines = (
+        batch_line(summary_custom_id(sections), SUMMARY_MODEL, build_summary_messages(sections))
+        for sections in unique_sections
+        if sections and (sections_filter is None or sections in sections_filter)
+    )
+    return write_batch_file(batch_file, lines)
 
-def process_chunks(input_file, output_file):
+def ingest_summary_batch(input_file, results_files, output_file, retry_batch_file):
     """
-    Reads chunks from input JSON, generates summaries progressively, updates text, and saves each processed chunk immediately.
+    Merges batch summaries into the chunks in input order. Chunks whose summary is missing are
+    left out and their section lists are written to a retry batch file.
     """
-    with open(input_file, "r", encoding="utf-8") as infile:
+    metrics.record_file(input_file, "read")
+    with metrics.stage("load_chunks"), open(input_file, "r", encoding="utf-8") as infile:
         chunks = json.load(infile)
+    results = load_batch_results(results_files)
 
-    last_saved_index = get_last_saved_index(output_file)
+    missing_sections = set()
+    journal = checkpoint_journal.open_journal(output_file)
+    try:
+        journal.remove_from(0)  # The batch results replace any earlier progress
+        for i, chunk in enumerate(chunks):
+            sections = chunk.get("metadata", {}).get("sections", [])
+            if sections:
+                summary = results.get(summary_custom_id(sections))
+                if not summary:
+                    missing_sections.add(tuple(sections))
+                    continue
+                cache.put(SUMMARY_MODEL, None, build_summary_messages(sections), summary)
+                chunk["text"] = f"{summary}\n\n{chunk['text']}"
 
-    for i, chunk in enumerate(chunks[last_saved_index:], start=last_saved_index):
-        metadata = chunk.get("metadata", {})
-        sections = metadata.get("sections", [])
-        if sections:
-            # Generate section summary using OpenAI
-            summary = generate_section_summary(sections)
-            # Prepend summary and a separator (two newlines) to the chunk's text
-            chunk["text"] = f"{summary}\n\n{chunk['text']}"
-        
-        chunk["metadata"]["chunk_number"] = i + 1  # Ensure chunk number is accurate
-        save_chunk(output_file, chunk)  # Save each chunk progressively
+            chunk["metadata"]["chunk_number"] = i + 1
+            journal.append(i, chunk)
+    finally:
+        journal.close()
+        checkpoint_journal.compact(output_file, indent=2, ensure_ascii=False)
 
-    print(f"\nAll chunks processed and saved in {output_file}")
+    if missing_sections:
+        print(f"⚠️ {len(missing_sections)} section sets had no valid batch reply.")
+        build_summary_batch(input_file, retry_batch_file, missing_sections)
+    else:
+        print(f"\nAll chunks processed and saved in {output_file}")
+    return missing_sections
 
 if __name__ == "__main__":
     input_file = "classified_catalog_agent_new.json"  # Input file containing the original chunks
     output_file = "catalog_english_headers.json"  # Output file for updated chunks
-    process_chunks(input_file, output_file)
+
+    parser = argparse.ArgumentParser(description="Prepend GPT section summaries to classified chunks.")
+    parser.add_argument("--previous-output", metavar="OUTPUT_FILE",
+                        help="Incremental run: keep summaries of chunks whose id and sections are unchanged")
+    parser.add_argument("--labels", metavar="LABELS_FILE",
+                        help="Write a label sidecar (sections and summary per chunk) instead of a full catalog copy")
+    parser.add_argument("--build-batch", metavar="BATCH_FILE",
+                        help="Write an OpenAI Batch API request file instead of calling the API")
+    parser.add_argument("--ingest-batch", metavar="RESULTS_FILE", nargs="+",
+                        help="Merge Batch API results files (later files override earlier ones) into the output")
+    parser.add_argument("--retry-batch", metavar="BATCH_FILE", default="summary_batch_retry.jsonl",
+                        help="Where --ingest-batch writes requests for section sets that need another try")
+    args = parser.parse_args()
+
+    if args.labels:
+        write_summary_labels(input_file, args.labels)
+    elif args.build_batch:
+        build_summary_batch(input_file, args.build_batch)
+    elif args.ingest_batch:
+        ingest_summary_batch(input_file, args.ingest_batch, output_file, args.retry_batch)
+    else:
+        process_chunks(input_file, output_file, previous_output=args.previous_output)
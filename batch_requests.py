@@ -0,0 +1,110 @@
+import argparse
+import json
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+def batch_line(custom_id, model, messages, **params):
+    """
+    Builds one OpenAI Batch API request line for a chat completion.
+    """
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "messages": messages, **params},
+    }
+
+def write_batch_file(batch_file, lines):
+    """
+    Writes batch request lines as JSONL and returns how many were written.
+    """
+    count = 0
+    with open(batch_file, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"📦 Wrote {count} batch requests to {batch_file}")
+    return count
+
+def read_batch_results(results_file):
+    """
+    Parses a Batch API output (or error) file.
+    Returns a dict mapping custom_id to the reply text, or None for requests that failed.
+    """
+    results = {}
+    with open(results_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            content = None
+            if not record.get("error") and response.get("status_code") == 200:
+                try:
+                    content = body["choices"][0]["message"]["content"].strip()
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    content = None
+            results[record["custom_id"]] = content
+    return results
+
+def load_batch_results(results_files):
+    """
+    Merges several results files; a later file overrides an earlier one (e.g. a retry batch).
+    """
+    results = {}
+    for results_file in results_files:
+        for custom_id, content in read_batch_results(results_file).items():
+            if content is not None or custom_id not in results:
+                results[custom_id] = content
+    return results
+
+def submit_batch(client, batch_file, description=None):
+    """
+    Uploads a batch request file and starts the batch. Returns the batch id.
+    """
+    with open(batch_file, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata={"description": description or batch_file},
+    )
+    print(f"🚀 Submitted {batch_file} as batch {batch.id}")
+    return batch.id
+
+def download_batch_results(client, batch_id, results_file):
+    """
+    Downloads a finished batch's output to results_file. Returns False if the batch is not done yet.
+    Failed requests are appended from the batch's error file so ingest can report them.
+    """
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        print(f"⏳ Batch {batch_id} is {batch.status} ({batch.request_counts})")
+        return False
+
+    with open(results_file, "w", encoding="utf-8") as f:
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                f.write(client.files.content(file_id).text)
+    print(f"✅ Batch {batch_id} results saved to {results_file}")
+    return True
+
+if __name__ == "__main__":
+    import openai
+
+    parser = argparse.ArgumentParser(description="Submit OpenAI batch request files and download their results.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    submit_parser = subparsers.add_parser("submit", help="Upload a batch request file and start the batch")
+    submit_parser.add_argument("batch_file")
+    download_parser = subparsers.add_parser("download", help="Download the results of a completed batch")
+    download_parser.add_argument("batch_id")
+    download_parser.add_argument("results_file")
+    args = parser.parse_args()
+
+    client = openai.OpenAI()
+    if args.command == "submit":
+        submit_batch(client, args.batch_file)
+    else:
+        download_batch_results(client, args.batch_id, args.results_file)
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from fake_openai_server import FakeOpenAIConfig, start_server
+
+SCENARIOS = ["classify", "classify-async", "summaries"]
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+REQUESTS_PER_MINUTE = 100_000  # High enough that the fake server, not the scheduler, sets the pace
+TOKENS_PER_MINUTE = 50_000_000
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers; None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def timed_create(create, latencies):
+    def create_with_timing(**kwargs):
+        start = time.perf_counter()
+        try:
+            return create(**kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return create_with_timing
+
+def timed_create_async(create, latencies):
+    async def create_with_timing(**kwargs):
+        start = time.perf_counter()
+        try:
+            return await create(**kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return create_with_timing
+
+def write_subset(source_file, target_file, limit):
+    with open(source_file, "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    with open(target_file, "w", encoding="utf-8") as f:
+        json.dump(chunks[:limit] if limit else chunks, f)
+
+def run_worker(args):
+    """
+    Runs one scenario in this process (started by run_scenario with OPENAI_BASE_URL pointing at the
+    fake server) and writes its measurements to args.result_file.
+    """
+    os.chdir(args.work_dir)  # The pipelines open their cache and outputs relative to the working directory
+    sys.path.insert(0, REPO_DIR)
+    from llm_scheduler import TokenBucket
+    latencies = []
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if args.worker == "summaries":
+            import add_english_headers as module
+            module.scheduler.request_bucket = TokenBucket(args.rpm)
+            module.scheduler.token_bucket = TokenBucket(args.tpm)
+            module.client.chat.completions.create = timed_create(module.client.chat.completions.create, latencies)
+            output_file = "catalog_english_headers.json"
+            start = time.perf_counter()
+            module.process_chunks(args.chunk_file, output_file)
+        else:
+            import classification_agent_new as module
+            module.scheduler.request_bucket = TokenBucket(args.rpm)
+            module.scheduler.token_bucket = TokenBucket(args.tpm)
+            module.client.chat.completions.create = timed_create(module.client.chat.completions.create, latencies)
+            module.async_client.chat.completions.create = timed_create_async(
+                module.async_client.chat.completions.create, latencies)
+            output_file = "classified_catalog_agent_new.json"
+            options = {"pack_size": args.pack_size, "structured": args.structured, "use_fast_path": not args.no_fast_path}
+            start = time.perf_counter()
+            if args.worker == "classify-async":
+                asyncio.run(module.classify_chunks_with_llm_async(
+                    args.chunk_file, args.header_file, output_file, args.max_in_flight, **options))
+            else:
+                module.classify_chunks_with_llm(args.chunk_file, args.header_file, output_file, **options)
+        elapsed = time.perf_counter() - start
+
+    with open(output_file, "r", encoding="utf-8") as f:
+        chunk_count = len(json.load(f))
+    result = {
+        "chunks": chunk_count,
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(chunk_count / elapsed, 2) if elapsed else None,
+        "requests": len(latencies),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "retries": module.scheduler.retries,
+        "retry_reasons": dict(module.scheduler.retry_reasons),
+        "dead_letters": len(module.scheduler.dead_letters),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # ru_maxrss is in KiB on Linux
+    }
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+def run_scenario(scenario, server, args):
+    """
+    Runs a scenario in a fresh interpreter (so peak RSS and the response cache are its own) and
+    returns its measurements plus what the fake server saw.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        chunk_file = os.path.join(work_dir, "input.json")
+        source_file = args.classified_file if scenario == "summaries" else args.chunk_file
+        write_subset(source_file, chunk_file, args.chunks)
+        result_file = os.path.join(work_dir, "result.json")
+
+        command = [
+            sys.executable, os.path.abspath(__file__), "--worker", scenario,
+            "--work-dir", work_dir, "--result-file", result_file,
+            "--chunk-file", chunk_file, "--header-file", os.path.abspath(args.header_file),
+            "--max-in-flight", str(args.max_in_flight), "--pack-size", str(args.pack_size),
+            "--rpm", str(args.rpm), "--tpm", str(args.tpm),
+        ]
+        if args.no_fast_path:
+            command.append("--no-fast-path")
+        if args.structured:
+            command.append("--structured")
+        env = dict(os.environ, OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY="fake-key")
+
+        before = server.snapshot()
+        subprocess.run(command, env=env, check=True)
+        after = server.snapshot()
+
+        with open(result_file, "r", encoding="utf-8") as f:
+            result = json.load(f)
+    result["server"] = {name: after[name] - before[name] for name in after}
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(args):
+    config = FakeOpenAIConfig(args.latency_ms, args.latency_sigma, args.rate_limit_rate, args.retry_after_ms,
+                              args.malformed_rate, args.seed)
+    server = start_server(config)
+    try:
+        results = {}
+        for scenario in args.scenarios:
+            print(f"⏱️ Running {scenario} on {args.chunks or 'all'} chunks...")
+            results[scenario] = result = run_scenario(scenario, server, args)
+            print(
+                f"   {result['chunks_per_sec']} chunks/sec, p50 {result['latency_p50_ms']} ms, "
+                f"p95 {result['latency_p95_ms']} ms, {result['retries']} retries, "
+                f"peak RSS {result['peak_rss_mb']} MB"
+            )
+    finally:
+        server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "chunks": args.chunks,
+            "latency_ms": args.latency_ms,
+            "latency_sigma": args.latency_sigma,
+            "rate_limit_rate": args.rate_limit_rate,
+            "malformed_rate": args.malformed_rate,
+            "max_in_flight": args.max_in_flight,
+            "pack_size": args.pack_size,
+            "fast_path": not args.no_fast_path,
+            "structured": args.structured,
+            "requests_per_minute": args.rpm,
+            "tokens_per_minute": args.tpm,
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"✅ Benchmark results saved to {args.output}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the classification and summary pipelines against a fake OpenAI endpoint.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--chunks", type=int, default=200, help="Number of chunks to run (0 for all)")
+    parser.add_argument("--chunk-file", default="catalog.json")
+    parser.add_argument("--classified-file", default="classified_catalog_agent_new.json",
+                        help="Input for the summaries scenario")
+    parser.add_argument("--header-file", default="toc_headers_with_page_ranges.json")
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after-ms", type=int, default=200)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--no-fast-path", action="store_true")
+    parser.add_argument("--structured", action="store_true", help="Use schema-constrained replies")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE,
+                        help="Requests per minute allowed by the pipelines' scheduler")
+    parser.add_argument("--tpm", type=float, default=TOKENS_PER_MINUTE,
+                        help="Tokens per minute allowed by the pipelines' scheduler")
+    parser.add_argument("--output", default="benchmark_results.json", help="Machine-readable results file")
+    # Internal: run one scenario inside the subprocess
+    parser.add_argument("--worker", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+    else:
+        args.chunk_file = os.path.abspath(args.chunk_file)
+        args.classified_file = os.path.abspath(args.classified_file)
+        run_benchmarks(args)
@@ -0,0 +1,176 @@
+import math
+import threading
+import time
+
+from llm_scheduler import InvalidResponse, RetryBudgetExhausted
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+def answer_confidence(choice):
+    """
+    Probability the model assigned to its whole answer: exp of the summed token logprobs.
+    Returns 0.0 when the reply carries no logprobs.
+    """
+    tokens = getattr(getattr(choice, "logprobs", None), "content", None)
+    if not tokens:
+        return 0.0
+    return math.exp(sum(token.logprob for token in tokens))
+
+class TierStats:
+    def __init__(self):
+        self.requests = 0
+        self.accepted = 0
+        self.escalated = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.seconds = 0.0
+
+    def cost(self, model):
+        prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1_000_000
+
+class ModelCascade:
+    """
+    Asks the cheap model first, with logprobs. Its answer is accepted when it parses, passes the
+    caller's consistency check (parse returns None otherwise) and its confidence reaches the
+    threshold; any other answer is escalated to the strong model, which is retried until valid.
+    """
+
+    def __init__(self, scheduler, cache=None, cheap_model="gpt-4o-mini", strong_model="gpt-4o",
+                 threshold=0.9, temperature=0.2):
+        self.scheduler = scheduler
+        self.cache = cache
+        self.cheap_model = cheap_model
+        self.strong_model = strong_model
+        self.threshold = threshold
+        self.temperature = temperature
+        self.tiers = {cheap_model: TierStats(), strong_model: TierStats()}
+        self._lock = threading.Lock()
+
+    def _record(self, model, response, seconds):
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            tier = self.tiers[model]
+            tier.requests += 1
+            tier.seconds += seconds
+            if usage is not None:
+                tier.prompt_tokens += usage.prompt_tokens or 0
+                tier.completion_tokens += usage.completion_tokens or 0
+
+    def _count(self, model, outcome):
+        with self._lock:
+            setattr(self.tiers[model], outcome, getattr(self.tiers[model], outcome) + 1)
+
+    def _timed(self, model, request):
+        def timed_request():
+            start = time.perf_counter()
+            response = request()
+            self._record(model, response, time.perf_counter() - start)
+            return response
+        return timed_request
+
+    def _timed_async(self, model, request):
+        async def timed_request():
+            start = time.perf_counter()
+            response = await request()
+            self._record(model, response, time.perf_counter() - start)
+            return response
+        return timed_request
+
+    def _cached(self, messages, parse):
+        if self.cache is None:
+            return None
+        # A strong-model reply cached by the plain (non-cascade) path is just as good
+        for model, params in ((self.strong_model, {}), (self.cheap_model, {"logprobs": True})):
+            raw_response = self.cache.get(model, self.temperature, messages, **params)
+            result = parse(raw_response) if raw_response is not None else None
+            if result is not None:
+                self._count(model, "accepted")
+                return result
+        return None
+
+    def _judge_cheap(self, messages, parse, response):
+        choice = response.choices[0]
+        raw_response = (choice.message.content or "").strip()
+        result = parse(raw_response)
+        confidence = answer_confidence(choice)
+        if result is not None and confidence >= self.threshold:
+            self._count(self.cheap_model, "accepted")
+            if self.cache is not None:
+                self.cache.put(self.cheap_model, self.temperature, messages, raw_response, logprobs=True)
+            return result
+        self._count(self.cheap_model, "escalated")
+        print(f"⤴️ Escalating to {self.strong_model}: {self.cheap_model} answered {raw_response!r} "
+              f"with confidence {confidence:.2f}")
+        return None
+
+    def _strong_validator(self, messages, parse):
+        def validate(response):
+            raw_response = (response.choices[0].message.content or "").strip()
+            result = parse(raw_response)
+            if result is None:
+                raise InvalidResponse(f"Invalid format received: {raw_response!r}")
+            self._count(self.strong_model, "accepted")
+            if self.cache is not None:
+                self.cache.put(self.strong_model, self.temperature, messages, raw_response)
+            return result
+        return validate
+
+    def run(self, request_for, messages, parse, key=None):
+        """
+        request_for(model, **params) returns a function that sends messages to that model.
+        parse(raw_response) returns the usable result, or None if the answer is malformed or
+        inconsistent with the candidates. Raises RetryBudgetExhausted if the strong model gives up.
+        """
+        result = self._cached(messages, parse)
+        if result is not None:
+            return result
+        try:
+            response = self.scheduler.call(
+                self._timed(self.cheap_model, request_for(self.cheap_model, logprobs=True)), messages, key=key,
+                dead_letter=False)
+            result = self._judge_cheap(messages, parse, response)
+        except RetryBudgetExhausted:
+            self._count(self.cheap_model, "escalated")
+        if result is not None:
+            return result
+        return self.scheduler.call(self._timed(self.strong_model, request_for(self.strong_model)), messages,
+                                   key=key, validate=self._strong_validator(messages, parse))
+
+    async def run_async(self, request_for, messages, parse, key=None):
+        """
+        Async counterpart of run(); request_for returns a coroutine function.
+        """
+        result = self._cached(messages, parse)
+        if result is not None:
+            return result
+        try:
+            response = await self.scheduler.call_async(
+                self._timed_async(self.cheap_model, request_for(self.cheap_model, logprobs=True)), messages, key=key,
+                dead_letter=False)
+            result = self._judge_cheap(messages, parse, response)
+        except RetryBudgetExhausted:
+            self._count(self.cheap_model, "escalated")
+        if result is not None:
+            return result
+        return await self.scheduler.call_async(
+            self._timed_async(self.strong_model, request_for(self.strong_model)), messages,
+            key=key, validate=self._strong_validator(messages, parse))
+
+    def report(self):
+        total_cost = 0.0
+        for model, tier in self.tiers.items():
+            if not tier.requests and not tier.accepted:
+                continue
+            cost = tier.cost(model)
+            total_cost += cost
+            average_ms = tier.seconds / tier.requests * 1000 if tier.requests else 0.0
+            escalated = f", {tier.escalated} escalated" if model == self.cheap_model else ""
+            print(f"🪜 {model}: {tier.requests} requests, {tier.accepted} answers kept{escalated}, "
+                  f"{tier.prompt_tokens + tier.completion_tokens} tokens, ${cost:.4f}, avg {average_ms:.0f} ms")
+        if total_cost:
+            print(f"💰 Cascade cost: ${total_cost:.4f}")
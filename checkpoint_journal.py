@@ -0,0 +1,227 @@
+import bisect
+import json
+import os
+
+from metrics import metrics
+
+# How many appended records to buffer before forcing them to disk with fsync
+DEFAULT_FSYNC_EVERY = 25
+
+def journal_path(output_file):
+    """
+    Returns the journal file that backs the given JSON output file.
+    """
+    return os.path.splitext(output_file)[0] + ".journal.jsonl"
+
+class JournalWriter:
+    """
+    Appends one JSON record per processed chunk instead of rewriting the whole output file.
+    Each line is {"index": <chunk index>, "chunk": <chunk>}; a null chunk is a tombstone that
+    removes the record at that index and everything after it (used for undo). A record marked
+    "fill" fills a gap below the tail (a chunk retried after it was dead-lettered) and, unlike a
+    plain record, leaves the records after it in place.
+    """
+
+    def __init__(self, path, fsync_every=DEFAULT_FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._unsynced = 0
+        _repair_torn_tail(path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, index, chunk, fill=False):
+        record = {"index": index, "chunk": chunk}
+        if fill:
+            record["fill"] = True
+        self._write(record)
+
+    def remove_from(self, index):
+        self._write({"index": index, "chunk": None})
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self._file.write(line)
+        metrics.inc("file_bytes_total", len(line.encode("utf-8")), direction="written")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _repair_torn_tail(path):
+    """
+    Drops a partially written last line left behind by a crash so new records start on a fresh line.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                f.truncate(pos + newline + 1)
+                return
+        f.truncate(0)
+
+def _iter_lines_reversed(path, block_size=65536):
+    """
+    Yields the non-empty lines of a file from last to first, reading it backwards in blocks.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buffer = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            buffer = f.read(step) + buffer
+            lines = buffer.split(b"\n")
+            buffer = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+
+def read_tail(path):
+    """
+    Finds the last live record by reading the journal backwards.
+    Returns (resume_index, last_chunk), or (0, None) if nothing has been recorded yet.
+    Gap fills written after the last plain record only count if they lie beyond it.
+    """
+    if not os.path.exists(path):
+        return 0, None
+
+    cutoff = None
+    fill = None  # Highest live gap fill seen so far, as (index, chunk)
+    for line in _iter_lines_reversed(path):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # Torn write from a crash
+        index = record["index"]
+        if cutoff is not None and index >= cutoff:
+            continue  # Removed by a later tombstone
+        if record["chunk"] is None:
+            cutoff = index
+            continue
+        if record.get("fill"):
+            if fill is None or index > fill[0]:
+                fill = (index, record["chunk"])
+            continue
+        if fill is not None and fill[0] > index:
+            index, record["chunk"] = fill
+        return index + 1, record["chunk"]
+    if fill is not None:
+        return fill[0] + 1, fill[1]
+    return 0, None
+
+def replay_records(path):
+    """
+    Replays the journal in order and returns the live (index, chunk) records in index order.
+    """
+    records = []
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("fill"):
+                position = bisect.bisect_left([index for index, _ in records], record["index"])
+                if position < len(records) and records[position][0] == record["index"]:
+                    records[position] = (record["index"], record["chunk"])
+                else:
+                    records.insert(position, (record["index"], record["chunk"]))
+                continue
+            while records and records[-1][0] >= record["index"]:
+                records.pop()
+            if record["chunk"] is not None:
+                records.append((record["index"], record["chunk"]))
+    return records
+
+def replay(path):
+    """
+    Replays the journal in order and returns the list of live chunks.
+    """
+    return [chunk for _, chunk in replay_records(path)]
+
+def missing_indices(path):
+    """
+    Returns the indices below the journal's tail that have no live record, in order: chunks that
+    were dead-lettered or otherwise skipped, which a resumed run should try again.
+    """
+    present = [index for index, _ in replay_records(path)]
+    if not present:
+        return []
+    present_set = set(present)
+    return [index for index in range(present[-1]) if index not in present_set]
+
+def seed_from_output(path, output_file):
+    """
+    Imports an existing JSON output file (from before journals existed) so a run can resume from it.
+    """
+    if os.path.exists(path) or not os.path.exists(output_file):
+        return
+    with open(output_file, "r", encoding="utf-8") as f:
+        try:
+            classified_chunks = json.load(f)
+        except json.JSONDecodeError:
+            return
+    with JournalWriter(path) as writer:
+        for i, chunk in enumerate(classified_chunks):
+            writer.append(i, chunk)
+
+def open_journal(output_file, fsync_every=DEFAULT_FSYNC_EVERY):
+    """
+    Opens the journal for an output file, seeding it from the output file the first time.
+    """
+    path = journal_path(output_file)
+    seed_from_output(path, output_file)
+    return JournalWriter(path, fsync_every)
+
+def compact(output_file, **dump_kwargs):
+    """
+    Rebuilds the JSON array output file from its journal. The file is replaced atomically,
+    so a crash during compaction never leaves a half-written output behind.
+    """
+    chunks = replay(journal_path(output_file))
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(chunks, f, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, output_file)
+    metrics.record_file(output_file, "written")
+    print(f"\n✅ Compacted {len(chunks)} chunks into {output_file}")
+    return len(chunks)
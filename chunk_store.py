@@ -0,0 +1,233 @@
+import argparse
+import json
+import sqlite3
+
+from header_tree import HeaderTree
+
+DEFAULT_DB_FILE = "catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS headers (
+    id INTEGER PRIMARY KEY,         -- Position in the TOC, as in header_index / header_tree
+    header TEXT NOT NULL,           -- Full comma-joined path
+    title TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    parent_id INTEGER REFERENCES headers (id),
+    lft INTEGER NOT NULL,           -- Nested-set bounds: descendants have lft within [lft, rgt]
+    rgt INTEGER NOT NULL,
+    start_page INTEGER,
+    end_page INTEGER
+);
+CREATE INDEX IF NOT EXISTS headers_path ON headers (header);
+CREATE INDEX IF NOT EXISTS headers_lft ON headers (lft);
+
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_number INTEGER PRIMARY KEY,   -- 1-based position in the classified output
+    id TEXT NOT NULL,                   -- Content hash; repeated text shares an id
+    page_number INTEGER,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL              -- The chunk's metadata as JSON
+);
+CREATE INDEX IF NOT EXISTS chunks_page ON chunks (page_number);
+CREATE INDEX IF NOT EXISTS chunks_id ON chunks (id);
+
+CREATE TABLE IF NOT EXISTS chunk_headers (
+    header_id INTEGER NOT NULL REFERENCES headers (id),
+    chunk_number INTEGER NOT NULL REFERENCES chunks (chunk_number),
+    PRIMARY KEY (header_id, chunk_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunk_headers_chunk ON chunk_headers (chunk_number);
+"""
+
+def nested_set_bounds(tree):
+    """
+    Numbers the tree depth-first; returns {node_id: (lft, rgt)}.
+    """
+    bounds = {}
+    counter = 0
+    stack = [(node, False) for node in reversed(tree.roots)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            bounds[node.id] = (bounds[node.id], counter)
+            continue
+        counter += 1
+        bounds[node.id] = counter
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.children))
+    return bounds
+
+class ChunkStore:
+    """
+    SQLite store for classified chunks. Section and page lookups go through indexes, so a query
+    touches only the matching rows instead of loading the whole catalog.
+    """
+
+    def __init__(self, path=DEFAULT_DB_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def load_headers(self, headers):
+        """
+        Replaces the header table with the TOC entries (dicts with "header", optional
+        "level"/"title"/"start"/"end"), in one transaction. Returns the header tree.
+        """
+        tree = HeaderTree.from_headers(headers)
+        bounds = nested_set_bounds(tree)
+        rows = []
+        for node, entry in zip(tree.nodes, headers):
+            entry = entry if isinstance(entry, dict) else {}
+            lft, rgt = bounds[node.id]
+            rows.append((
+                node.id, node.header, node.title, node.level, node.parent.id if node.parent else None,
+                lft, rgt, entry.get("start", entry.get("page")), entry.get("end", entry.get("page")),
+            ))
+        with self._conn:
+            self._conn.execute("DELETE FROM headers")
+            self._conn.executemany("INSERT INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return tree
+
+    def clear_chunks(self):
+        """
+        Deletes every chunk and section link, in one transaction.
+        """
+        with self._conn:
+            self._conn.execute("DELETE FROM chunk_headers")
+            self._conn.execute("DELETE FROM chunks")
+
+    def add_chunks(self, chunks, tree, batch_size=1000):
+        """
+        Bulk inserts classified chunks and their section links, committing every batch_size chunks.
+        Chunks without "section_ids" matching the tree have their "sections" paths mapped onto it. A chunk
+        already stored under the same chunk_number is replaced along with its links.
+        Returns the number of chunks stored.
+        """
+        chunk_rows, link_rows = [], []
+        count = 0
+
+        def flush():
+            with self._conn:
+                self._conn.executemany("DELETE FROM chunk_headers WHERE chunk_number = ?",
+                                       ((row[0],) for row in chunk_rows))
+                self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", chunk_rows)
+                self._conn.executemany("INSERT OR IGNORE INTO chunk_headers VALUES (?, ?)", link_rows)
+            chunk_rows.clear()
+            link_rows.clear()
+
+        for position, chunk in enumerate(chunks):
+            metadata = chunk.get("metadata", {})
+            chunk_number = metadata.get("chunk_number", position + 1)
+            section_ids = tree.section_ids(metadata)
+            chunk_rows.append((chunk_number, chunk["id"], metadata.get("page_number"), chunk["text"],
+                               json.dumps(metadata, ensure_ascii=False)))
+            link_rows.extend((header_id, chunk_number) for header_id in section_ids)
+            count += 1
+            if len(chunk_rows) >= batch_size:
+                flush()
+        flush()
+        return count
+
+    def _chunk(self, row):
+        return {"id": row["id"], "text": row["text"], "metadata": json.loads(row["metadata"])}
+
+    def header_id(self, header):
+        """
+        Returns the id of a header path (the first entry if the TOC lists it twice), or None.
+        """
+        row = self._conn.execute("SELECT id FROM headers WHERE header = ? ORDER BY id LIMIT 1", (header,)).fetchone()
+        return row["id"] if row else None
+
+    def headers_with_prefix(self, prefix):
+        """
+        Returns (id, header) for every header path starting with prefix, using the path index.
+        """
+        return [tuple(row) for row in self._conn.execute(
+            "SELECT id, header FROM headers WHERE header >= ? AND header < ? ORDER BY id",
+            (prefix, prefix + "\U0010ffff"),
+        )]
+
+    def chunks_under(self, header_id, include_descendants=True):
+        """
+        Returns the chunks classified under a header (and, by default, under any of its descendants)
+        in catalog order.
+        """
+        if not include_descendants:
+            query = (
+                "SELECT c.* FROM chunk_headers l JOIN chunks c ON c.chunk_number = l.chunk_number"
+                " WHERE l.header_id = ? ORDER BY c.chunk_number"
+            )
+        else:
+            query = (
+                "SELECT DISTINCT c.* FROM headers h"
+                " JOIN headers d ON d.lft BETWEEN h.lft AND h.rgt"
+                " JOIN chunk_headers l ON l.header_id = d.id"
+                " JOIN chunks c ON c.chunk_number = l.chunk_number"
+                " WHERE h.id = ? ORDER BY c.chunk_number"
+            )
+        return [self._chunk(row) for row in self._conn.execute(query, (header_id,))]
+
+    def chunks_on_pages(self, first_page, last_page):
+        """
+        Returns the chunks on pages first_page..last_page (inclusive) in catalog order.
+        """
+        return [self._chunk(row) for row in self._conn.execute(
+            "SELECT * FROM chunks WHERE page_number BETWEEN ? AND ? ORDER BY chunk_number",
+            (first_page, last_page),
+        )]
+
+def export_chunks(chunk_file, header_file, db_file=DEFAULT_DB_FILE):
+    """
+    Builds the SQLite store from a classified output and the TOC it was classified with, replacing
+    whatever an earlier export stored.
+    """
+    with open(header_file, "r", encoding="utf-8") as f:
+        headers = json.load(f)
+    with open(chunk_file, "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+
+    with ChunkStore(db_file) as store:
+        store.clear_chunks()  # Chunks and links from an earlier export would point at the old TOC ids
+        tree = store.load_headers(headers)
+        count = store.add_chunks(chunks, tree)
+    print(f"✅ Stored {count} chunks and {len(tree)} headers in {db_file}")
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store classified chunks in SQLite and query them by section or page.")
+    parser.add_argument("--db", default=DEFAULT_DB_FILE, help="SQLite database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Load a classified output into the database")
+    export_parser.add_argument("chunk_file", nargs="?", default="classified_catalog_agent_new.json")
+    export_parser.add_argument("header_file", nargs="?", default="toc_headers_with_page_ranges.json")
+    under_parser = subparsers.add_parser("under", help="Print the chunks under a header path")
+    under_parser.add_argument("header")
+    under_parser.add_argument("--exact", action="store_true", help="Leave out chunks under descendant headers")
+    pages_parser = subparsers.add_parser("pages", help="Print the chunks on a page range")
+    pages_parser.add_argument("first_page", type=int)
+    pages_parser.add_argument("last_page", type=int)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_chunks(args.chunk_file, args.header_file, args.db)
+    else:
+        with ChunkStore(args.db) as store:
+            if args.command == "under":
+                header_id = store.header_id(args.header)
+                if header_id is None:
+                    parser.error(f"Unknown header: {args.header}")
+                chunks = store.chunks_under(header_id, include_descendants=not args.exact)
+            else:
+                chunks = store.chunks_on_pages(args.first_page, args.last_page)
+        print(json.dumps(chunks, indent=4, ensure_ascii=False))
@@ -0,0 +1,128 @@
+import argparse
+import hashlib
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+from json_stream import write_json_array
+
+CHUNK_SIZE = 1500  # Maximum characters per chunk
+PAGES_PER_TASK = 32  # Pages extracted by a worker per task
+
+def page_count(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def extract_page_range(pdf_path, first_page, last_page):
+    """
+    Extracts the text of pages first_page..last_page (1-based, inclusive). Runs in a worker process,
+    which opens its own handle on the PDF.
+    """
+    with fitz.open(pdf_path) as doc:
+        return [doc[number - 1].get_text() for number in range(first_page, last_page + 1)]
+
+def iter_pages(pdf_path, workers=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Yields (page_number, text) in page order while worker processes extract page ranges in parallel.
+    Only a few ranges per worker are queued at a time, so memory stays flat for any PDF size.
+    """
+    total_pages = page_count(pdf_path)
+    ranges = deque(
+        (first, min(first + pages_per_task - 1, total_pages))
+        for first in range(1, total_pages + 1, pages_per_task)
+    )
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        while ranges or pending:
+            while ranges and len(pending) < workers * 2:
+                first, last = ranges.popleft()
+                pending.append((first, executor.submit(extract_page_range, pdf_path, first, last)))
+            first, future = pending.popleft()
+            for offset, text in enumerate(future.result()):
+                yield first + offset, text
+
+def make_chunk(text, page_number, chunk_number, source="catalog"):
+    """
+    Builds a chunk record; the id is the SHA-256 of the chunk text.
+    """
+    return {
+        "id": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        "text": text,
+        "metadata": {
+            "source": source,
+            "page_number": page_number,
+            "chunk_number": chunk_number
+        }
+    }
+
+def chunk_pages(pages, chunk_size=CHUNK_SIZE, source="catalog"):
+    """
+    Packs whole lines into chunks of at most chunk_size characters, across page boundaries.
+    A chunk is tagged with the page it starts on and numbered within that page.
+    Lines longer than chunk_size are split.
+    """
+    chunks_per_page = Counter()
+    lines, start_page, size = [], None, 0
+
+    def flush():
+        chunks_per_page[start_page] += 1
+        return make_chunk("\n".join(lines), start_page, chunks_per_page[start_page], source)
+
+    for page_number, text in pages:
+        for line in text.splitlines():
+            line = line.rstrip()
+            if not line:
+                continue
+            for piece in (line[i:i + chunk_size] for i in range(0, len(line), chunk_size)):
+                if lines and size + 1 + len(piece) > chunk_size:
+                    yield flush()
+                    lines, size = [], 0
+                if not lines:
+                    start_page = page_number
+                    size = len(piece)
+                else:
+                    size += 1 + len(piece)
+                lines.append(piece)
+    if lines:
+        yield flush()
+
+def chunk_pdf(pdf_path, output_file, text_file=None, workers=None, chunk_size=CHUNK_SIZE,
+              pages_per_task=PAGES_PER_TASK):
+    """
+    Extracts, chunks and saves a PDF in one streaming pass. Optionally also writes the raw page
+    text to text_file.
+    """
+    pages = iter_pages(pdf_path, workers, pages_per_task)
+    text_out = open(text_file, "w", encoding="utf-8") if text_file else None
+
+    def tee(pages):
+        for page_number, text in pages:
+            if text_out:
+                text_out.write(text)
+            yield page_number, text
+
+    try:
+        count = write_json_array(chunk_pages(tee(pages), chunk_size), output_file)
+    finally:
+        if text_out:
+            text_out.close()
+
+    print(f"✅ Saved {count} chunks to {output_file}")
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract and chunk catalog PDF text in parallel.")
+    parser.add_argument("pdf_path", nargs="?", default="catalog.pdf")
+    parser.add_argument("--output", default="catalog.json", help="Chunk JSON file to write")
+    parser.add_argument("--text-file", help="Also save the extracted page text (e.g. full_catalog_text.txt)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Maximum characters per chunk")
+    parser.add_argument("--pages-per-task", type=int, default=PAGES_PER_TASK,
+                        help="Pages extracted by a worker per task")
+    args = parser.parse_args()
+
+    chunk_pdf(args.pdf_path, args.output, args.text_file, args.workers, args.chunk_size, args.pages_per_task)
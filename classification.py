@@ -1,5 +1,14 @@
+import argparse
 import json
-import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import checkpoint_journal
+
+WINDOW_SIZE = 10  # Headers shown per chunk, starting from the last selected one
+PREFETCH_AHEAD = 5  # Upcoming chunks whose suggestions are computed while the reviewer reads
 
 # Load the list of hierarchical headers from the TOC file
 def load_headers(header_file):
@@ -11,32 +20,105 @@ def load_chunks(chunk_file):
     with open(chunk_file, "r", encoding="utf-8") as f:
         return json.load(f)
 
-# Save classified chunks to the output JSON file
-def save_chunks(output_file, classified_chunks):
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(classified_chunks, f, indent=4)
-    print(f"\n✅ Progress saved to {output_file}")
+# Rebuild the output JSON file from its journal
+def save_chunks(output_file):
+    checkpoint_journal.compact(output_file, indent=4)
 
-# Find the last saved chunk index and last selected header index
+# Find the last saved chunk index and last selected header index from the tail of the journal
 def get_last_saved_index(output_file):
-    if os.path.exists(output_file):
-        with open(output_file, "r", encoding="utf-8") as f:
-            classified_chunks = json.load(f)
-            if classified_chunks:
-                last_selected_index = classified_chunks[-1]["metadata"].get("last_selected_index", 0)
-                return len(classified_chunks), last_selected_index  # Resume from next chunk
+    resume_index, last_chunk = checkpoint_journal.read_tail(checkpoint_journal.journal_path(output_file))
+    if last_chunk:
+        last_selected_index = last_chunk["metadata"].get("last_selected_index", 0)
+        return resume_index, last_selected_index  # Resume from next chunk
     return 0, 0  # Start from the beginning
 
+class MainThreadOutput:
+    """
+    Stands in for sys.stdout while suggestions are prefetched, dropping output from worker threads
+    so the model's debug prints don't interleave with the reviewer's prompt.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        if threading.current_thread() is threading.main_thread():
+            return self.stream.write(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+class SuggestionPrefetcher:
+    """
+    Computes model suggestions for the next few chunks in background threads while the reviewer
+    works on the current one. A suggestion depends on the header window shown, so it is keyed by
+    (chunk index, window start): once the reviewer's choice moves the window, or undo goes back,
+    suggestions for other windows are cancelled or simply never used.
+    """
+
+    def __init__(self, chunks, headers, lookahead=PREFETCH_AHEAD, workers=2):
+        from classification_agent import classify_with_gpt  # Needs openai only when suggestions are on
+        self.classify_with_gpt = classify_with_gpt
+        self.chunks = chunks
+        self.headers = headers
+        self.lookahead = lookahead
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}  # (chunk_index, window_start) -> Future of absolute header indices or None
+
+    def _suggest(self, chunk_index, window_start):
+        window = self.headers[window_start:window_start + WINDOW_SIZE]
+        try:
+            selected = self.classify_with_gpt(self.chunks[chunk_index]["text"], window,
+                                              key={"chunk_number": chunk_index + 1}, structured=True)
+        except Exception:
+            return None  # No suggestion; the reviewer picks by hand
+        return [window_start + i for i in selected]
+
+    def prefetch(self, chunk_index, window_start):
+        """
+        Makes sure suggestions for this chunk and the next lookahead chunks are queued, assuming the
+        window stays where it is, and cancels queued work that no longer matches.
+        """
+        wanted = {(i, window_start) for i in range(chunk_index, min(chunk_index + self.lookahead + 1, len(self.chunks)))}
+        for key in list(self.futures):
+            if key not in wanted:
+                self.futures.pop(key).cancel()
+        for key in sorted(wanted):
+            if key not in self.futures:
+                self.futures[key] = self.executor.submit(self._suggest, *key)
+
+    def get(self, chunk_index, window_start):
+        return self.futures.get((chunk_index, window_start))
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def describe_suggestion(headers, suggestion):
+    return ", ".join(f"[{i+1}] {headers[i]}" for i in suggestion)
+
 # Display header options, starting from last used section
-def get_user_selection(headers, start_index):
+def get_user_selection(headers, start_index, suggestion=None):
+    """
+    Asks the reviewer for the chunk's headers. suggestion is a Future of suggested header indices;
+    pressing Enter accepts it, waiting for it if it is still being computed.
+    """
     print("\n🔹 **Select the appropriate section(s) for this chunk** 🔹")
     print("   (Type 'undo' to go back, 'save' to save progress and exit)")
 
-    end_index = min(start_index + 10, len(headers))  # Show 10 headers at a time
+    end_index = min(start_index + WINDOW_SIZE, len(headers))  # Show 10 headers at a time
 
     for i in range(start_index, end_index):
         print(f"[{i+1}] {headers[i]}")
 
+    if suggestion is not None:
+        if suggestion.done() and suggestion.result():
+            print(f"\n💡 Suggested: {describe_suggestion(headers, suggestion.result())} (press Enter to accept)")
+        elif not suggestion.done():
+            print("\n⏳ Suggestion still loading (press Enter to wait for it)")
+
     while True:
         user_input = input("\nEnter numbers (e.g. 2-4 or 1,3,5) or 'undo'/'save': ").strip().lower()
 
@@ -44,6 +126,13 @@ def get_user_selection(headers, start_index):
             return "undo"
         elif user_input == "save":
             return "save"
+        elif not user_input and suggestion is not None:
+            suggested = suggestion.result()
+            if suggested:
+                print(f"✅ Accepted suggestion: {describe_suggestion(headers, suggested)}")
+                return list(suggested)
+            print("❌ No suggestion available for this chunk. Please enter numbers.")
+            continue
 
         selected_indices = []
         try:
@@ -63,67 +152,99 @@ def get_user_selection(headers, start_index):
         except ValueError:
             print("❌ Invalid input. Please enter numbers separated by commas or a range like 2-4.")
 
+def report_throughput(reviewed, accepted, seconds, suggest):
+    if reviewed <= 0:
+        return
+    rate = reviewed / seconds * 3600 if seconds else 0.0
+    summary = f"⏱️ Reviewed {reviewed} chunks in {seconds / 60:.1f} min ({rate:.0f} chunks/hour)"
+    if suggest:
+        summary += f"; {accepted} suggestions accepted as-is"
+    print(summary)
+
 # Main function to classify chunks
-def classify_chunks(chunk_file, header_file, output_file):
+def classify_chunks(chunk_file, header_file, output_file, suggest=False, lookahead=PREFETCH_AHEAD):
     headers = load_headers(header_file)  # Load TOC headers
     chunks = load_chunks(chunk_file)  # Load catalog chunks
+    journal = checkpoint_journal.open_journal(output_file)  # Seeds from a pre-journal output file if needed
     last_saved_index, last_selected_index = get_last_saved_index(output_file)  # Resume from last point
 
-    # If progress exists, load classified chunks; otherwise, start fresh
-    classified_chunks = []
-    if last_saved_index > 0:
-        with open(output_file, "r", encoding="utf-8") as f:
-            classified_chunks = json.load(f)
-
     chunk_index = last_saved_index  # Resume from the next chunk
-
-    while chunk_index < len(chunks):
-        chunk = chunks[chunk_index]
-
-        print("\n" + "=" * 80)
-        print(f"📜 Chunk #{chunk_index + 1}")
-        print("-" * 80)
-        print(chunk["text"])
-        print("=" * 80)
-
-        # Get user selection of headers, starting from the last used section
-        selected_indices = get_user_selection(headers, last_selected_index)
-
-        if selected_indices == "undo":
-            if classified_chunks:
-                last_selected_index = classified_chunks[-1]["metadata"].get("last_selected_index", 0)
-                classified_chunks.pop()
-                chunk_index -= 1
-                print("\n🔄 **Undo successful! Returning to previous chunk...**")
-            else:
-                print("❌ No previous chunk to undo!")
-            continue
-
-        if selected_indices == "save":
-            save_chunks(output_file, classified_chunks)
-            print("\n💾 **Progress saved! You can resume later.**")
-            return  # Exit safely
-
-        selected_headers = [headers[i] for i in selected_indices]
-
-        # Add selected headers to the chunk
-        chunk["metadata"]["section"] = selected_headers
-        chunk["metadata"]["last_selected_index"] = max(selected_indices) if selected_indices else last_selected_index
-        classified_chunks.append(chunk)
-
-        # Save progress after each classification
-        save_chunks(output_file, classified_chunks)
-
-        # Update for next chunk
-        last_selected_index = chunk["metadata"]["last_selected_index"]
-        chunk_index += 1
+    prefetcher = SuggestionPrefetcher(chunks, headers, lookahead) if suggest else None
+    if prefetcher:
+        sys.stdout = MainThreadOutput(sys.stdout)
+    session_start, reviewed, accepted = time.monotonic(), 0, set()  # accepted: chunk indices
+
+    try:
+        while chunk_index < len(chunks):
+            chunk = chunks[chunk_index]
+            suggestion = None
+            if prefetcher:
+                prefetcher.prefetch(chunk_index, last_selected_index)
+                suggestion = prefetcher.get(chunk_index, last_selected_index)
+
+            print("\n" + "=" * 80)
+            print(f"📜 Chunk #{chunk_index + 1}")
+            print("-" * 80)
+            print(chunk["text"])
+            print("=" * 80)
+
+            # Get user selection of headers, starting from the last used section
+            selected_indices = get_user_selection(headers, last_selected_index, suggestion)
+
+            if selected_indices == "undo":
+                saved_count, previous_selected_index = get_last_saved_index(output_file)
+                if saved_count > 0:
+                    last_selected_index = previous_selected_index
+                    chunk_index -= 1
+                    journal.remove_from(chunk_index)  # Tombstone the previous chunk's record
+                    reviewed -= 1
+                    accepted.discard(chunk_index)
+                    print("\n🔄 **Undo successful! Returning to previous chunk...**")
+                else:
+                    print("❌ No previous chunk to undo!")
+                continue
+
+            if selected_indices == "save":
+                print("\n💾 **Progress saved! You can resume later.**")
+                return  # Exit safely; the journal is compacted below
+
+            selected_headers = [headers[i] for i in selected_indices]
+            if suggestion is not None and suggestion.done() and selected_indices == suggestion.result():
+                accepted.add(chunk_index)
+
+            # Add selected headers to the chunk
+            chunk["metadata"]["section"] = selected_headers
+            chunk["metadata"]["last_selected_index"] = max(selected_indices) if selected_indices else last_selected_index
+
+            # Save progress after each classification
+            journal.append(chunk_index, chunk)
+
+            # Update for next chunk
+            last_selected_index = chunk["metadata"]["last_selected_index"]
+            chunk_index += 1
+            reviewed += 1
+    finally:
+        if prefetcher:
+            prefetcher.close()
+            sys.stdout = sys.stdout.stream
+        journal.close()
+        save_chunks(output_file)
+        report_throughput(reviewed, len(accepted), time.monotonic() - session_start, suggest)
 
     print("\n🎉 **All chunks classified successfully!**")
 
-# File paths
-chunk_file = "catalog.json"  # JSON file containing chunks
-header_file = "toc_headers.txt"  # Text file with TOC headers
-output_file = "classified_catalog.json"
-
-# Run classification process
-classify_chunks(chunk_file, header_file, output_file)
+if __name__ == "__main__":
+    # File paths
+    chunk_file = "catalog.json"  # JSON file containing chunks
+    header_file = "toc_headers.txt"  # Text file with TOC headers
+    output_file = "classified_catalog.json"
+
+    parser = argparse.ArgumentParser(description="Classify catalog chunks into TOC headers by hand.")
+    parser.add_argument("--suggest", action="store_true",
+                        help="Prefetch model suggestions in the background; press Enter to accept one")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_AHEAD,
+                        help="How many chunks ahead suggestions are computed")
+    args = parser.parse_args()
+
+    # Run classification process
+    classify_chunks(chunk_file, header_file, output_file, args.suggest, args.prefetch)
@@ -1,155 +1,232 @@
+import argparse
 import json
-import os
 import openai
 
-client = openai.OpenAI()
+import checkpoint_journal
+from cascade import ModelCascade
+from header_retrieval import HeaderRetriever
+from llm_scheduler import InvalidResponse, RequestScheduler, RetryBudgetExhausted, dead_letter_path
+from metrics import metrics
+from structured_output import parse_header_ids, selection_response_format
+
+client = openai.OpenAI(max_retries=0)  # Retries are handled by the scheduler
+scheduler = RequestScheduler(requests_per_minute=500, tokens_per_minute=30_000)
+cascade = ModelCascade(scheduler, cheap_model="gpt-4o-mini", strong_model="gpt-4o", threshold=0.9, temperature=0.2)
+
+SHORTLIST_WINDOW = 40  # Headers after the last used one that are ranked locally
+SHORTLIST_K = 10  # Headers shown to GPT when the best local match is close to the last used one
+MAX_HEADER_ADVANCE = 10  # Most headers a single answer can move the window forward
 
 # Load the list of hierarchical headers from the TOC file
 def load_headers(header_file):
-    with open(header_file, "r", encoding="utf-8") as f:
+    metrics.record_file(header_file, "read")
+    with metrics.stage("load_headers"), open(header_file, "r", encoding="utf-8") as f:
         return [line.strip() for line in f.readlines() if line.strip()]
 
 # Load the JSON data of chunks
 def load_chunks(chunk_file):
-    with open(chunk_file, "r", encoding="utf-8") as f:
+    metrics.record_file(chunk_file, "read")
+    with metrics.stage("load_chunks"), open(chunk_file, "r", encoding="utf-8") as f:
         return json.load(f)
 
-# Save classified chunks to the output JSON file
-def save_chunks(output_file, classified_chunks):
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(classified_chunks, f, indent=4)
-    print(f"\n✅ Progress saved to {output_file}")
+# Append a classified chunk to the output file's journal
+def save_chunk(journal, chunk_index, chunk):
+    journal.append(chunk_index, chunk)
+    print(f"✅ Progress saved: Chunk #{chunk_index + 1} journaled")
 
-# Find the last saved chunk index
+# Rebuild the output JSON file from its journal
+def save_chunks(output_file):
+    with metrics.stage("compact"):
+        checkpoint_journal.compact(output_file, indent=4)
+
+# Find the last saved chunk index from the tail of the journal
 def get_last_saved_index(output_file):
-    if os.path.exists(output_file):
-        with open(output_file, "r", encoding="utf-8") as f:
-            classified_chunks = json.load(f)
-            if classified_chunks:
-                last_used_header_index = classified_chunks[-1]["metadata"].get("last_used_header_index", 0)
-                return len(classified_chunks), last_used_header_index  # Resume from next chunk
+    resume_index, last_chunk = checkpoint_journal.read_tail(checkpoint_journal.journal_path(output_file))
+    if last_chunk:
+        last_used_header_index = last_chunk["metadata"].get("last_used_header_index", 0)
+        return resume_index, last_used_header_index  # Resume from next chunk
     return 0, 0  # Start from the beginning
 
 # Classify a chunk using GPT while maintaining chronological TOC headers
 import re
 
-def classify_with_gpt(chunk_text, headers):
+# Parse a reply such as '1-4' or '1,2,3' into zero-based header indices
+def parse_indices(raw_response):
+    selected_indices = []
+    try:
+        for part in raw_response.split(","):
+            part = part.strip()
+            if "-" in part:
+                start, end = map(int, part.split("-"))
+                selected_indices.extend(range(start, end + 1))
+            else:
+                selected_indices.append(int(part))
+    except ValueError:
+        selected_indices = []
+
+    # Convert to zero-based index
+    return [i - 1 for i in selected_indices]
+
+# Zero-based indices of a reply, or None if it selects nothing or names a header outside the list
+def checked_indices(raw_response, headers):
+    selected_indices = parse_indices(raw_response)
+    if not selected_indices or any(not 0 <= i < len(headers) for i in selected_indices):
+        return None
+    return selected_indices
+
+# Zero-based indices of a structured reply ({"header_ids": [...]}), or None if it is not valid
+def structured_indices(raw_response, headers):
+    numbers = parse_header_ids(raw_response, headers)
+    return None if numbers is None else [number - 1 for number in numbers]
+
+def classify_with_gpt(chunk_text, headers, key=None, use_cascade=False, structured=False):
     """
     Uses GPT to classify a text chunk into one or more headers, starting from the given index.
     Expects GPT to return numbers corresponding to header indices. 
-    If the response is invalid, it retries until a proper format is received.
+    If the response is invalid, the scheduler retries it with backoff until its retry budget runs out.
+    With use_cascade, gpt-4o-mini answers first and unsure or out-of-range answers go to gpt-4o.
+    With structured, the reply is JSON whose header numbers a schema limits to the listed headers.
     """
-    while True:  # Keep asking GPT until the response is formatted correctly
-        response = client.chat.completions.create(
+    if structured:
+        answer_format = "Respond with the numbers of the selected headers in header_ids, selecting at least one."
+        closing = "Return the selected header numbers."
+    else:
+        answer_format = "Respond ONLY with numbers (e.g., '1-4' or '1,2,3') corresponding to the selected headers."
+        closing = "Return only numbers (e.g., '1-4' or '1,2,3')."
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are an assistant that categorizes text chunks into sections based on a list of ordered headers.\n"
+                "Do not skip headers—select all applicable headers in order.\n"
+                + answer_format + " The headers are chronological so none should be skipped. Look very carefully and if you cannot find a match, choose first header option. This is a last resort.\n"
+                "So you understand the acronyms, A&S = Arts and Sciences, Blair = School of Music, VUSE = Vanderbilt School of Engineering, PBDY = Peabody College of Education and Human Development.\n"
+                "Do NOT include explanations or any additional text."
+            )
+        },
+        {
+            "role": "user",
+            "content": (
+                f"Here is a section of text:\n{chunk_text}\n\n"
+                f"Which of these categories does this text belong to? Only select headers from this list, in chronological order:\n"
+                + "\n".join([f"[{i+1}] {header}" for i, header in enumerate(headers)])
+                + f"\n\n{closing}"
+            )
+        }
+    ]
+    format_params = {"response_format": selection_response_format(headers)} if structured else {}
+    parse = structured_indices if structured else checked_indices
+
+    if use_cascade:
+        def request_for(model, **params):
+            def request():
+                return client.chat.completions.create(model=model, messages=messages, temperature=0.2,
+                                                      **format_params, **params)
+            return request
+
+        return cascade.run(request_for, messages, lambda raw: parse(raw, headers), key=key)
+
+    def request():
+        return client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an assistant that categorizes text chunks into sections based on a list of ordered headers.\n"
-                        "Do not skip headers—select all applicable headers in order.\n"
-                        "Respond ONLY with numbers (e.g., '1-4' or '1,2,3') corresponding to the selected headers. The headers are chronological so none should be skipped. Look very carefully and if you cannot find a match, choose first header option. This is a last resort.\n"
-                        "So you understand the acronyms, A&S = Arts and Sciences, Blair = School of Music, VUSE = Vanderbilt School of Engineering, PBDY = Peabody College of Education and Human Development.\n"
-                        "Do NOT include explanations or any additional text."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Here is a section of text:\n{chunk_text}\n\n"
-                        f"Which of these categories does this text belong to? Only select headers from this list, in chronological order:\n"
-                        + "\n".join([f"[{i+1}] {header}" for i, header in enumerate(headers)])
-                        + "\n\nReturn only numbers (e.g., '1-4' or '1,2,3')."
-                    )
-                }
-            ],
-            temperature=0.2
+            messages=messages,
+            temperature=0.2,
+            **format_params
         )
 
+    def validate(response):
         raw_response = response.choices[0].message.content.strip()
         print(f"🔹 GPT Response: {raw_response}")  # Debugging output
 
-        # Extract numbers using regex
-        selected_indices = []
-        try:
-            for part in raw_response.split(","):
-                part = part.strip()
-                if "-" in part:
-                    start, end = map(int, part.split("-"))
-                    selected_indices.extend(range(start, end + 1))
-                else:
-                    selected_indices.append(int(part))
-
-            # Convert to zero-based index and filter out-of-range values
-            selected_indices = [i - 1 for i in selected_indices]
+        selected_indices = parse(raw_response, headers)
+        if not selected_indices:
+            raise InvalidResponse(f"Invalid format received: {raw_response!r}")
+        return selected_indices  # Return valid selections
 
-            if selected_indices:
-                return selected_indices  # Return valid selections
-        except ValueError:
-            pass  # If parsing fails, retry
-
-        print("⚠️ Invalid format received. Retrying...")  # Keep prompting until the response is valid
+    return scheduler.call(request, messages, key=key, validate=validate)
 
 
 # Main function to classify chunks automatically
-def classify_chunks_with_llm(chunk_file, header_file, output_file):
+def classify_chunks_with_llm(chunk_file, header_file, output_file, use_cascade=False, structured=False):
     headers = load_headers(header_file)  # Load TOC headers
+    retriever = HeaderRetriever(headers)  # Local BM25 ranking of headers
     chunks = load_chunks(chunk_file)  # Load catalog chunks
+    journal = checkpoint_journal.open_journal(output_file)  # Seeds from a pre-journal output file if needed
     last_saved_index, last_used_header_index = get_last_saved_index(output_file)  # Resume from last point
 
-    # If progress exists, load classified chunks; otherwise, start fresh
-    classified_chunks = []
-    if last_saved_index > 0:
-        with open(output_file, "r", encoding="utf-8") as f:
-            classified_chunks = json.load(f)
-
     chunk_index = last_saved_index  # Resume from the next chunk
 
-
-    while chunk_index < len(chunks):
-        chunk = chunks[chunk_index]
-        chunk_text = chunk["text"]
-
-        print(f"\n🔹 Classifying Chunk #{chunk_index + 1}/{len(chunks)}...")
-    
-        headers_list = headers[last_used_header_index:last_used_header_index+10]
-
-
-        # Ask GPT to select multiple headers, keeping chronological order
-        selected_indices = classify_with_gpt(chunk_text, headers_list)
-
-        # Adjust indices to reflect actual header positions
-        selected_indices = [i + last_used_header_index for i in selected_indices]  
-        selected_headers = [headers[i] for i in selected_indices]
-
-
-        if not selected_headers:
-            print("⚠️ No headers selected. Skipping this chunk.")
-        else:
-            print(f"✅ Assigned to sections: {selected_headers}")
-
-            # Update the chunk with selected headers
-            chunk["metadata"]["sections"] = selected_headers
-            # Update the last used header index properly
-            last_used_header_index = max(selected_indices) if selected_indices else last_used_header_index
-
-            chunk["metadata"]["last_used_header_index"] = last_used_header_index
-            chunk["metadata"]["chunk_number"] = chunk_index + 1
-
-
-            classified_chunks.append(chunk)
-
-            # Save progress after each classification
-            save_chunks(output_file, classified_chunks)
-
-        chunk_index += 1
+    try:
+        while chunk_index < len(chunks):
+            chunk = chunks[chunk_index]
+            chunk_text = chunk["text"]
+
+            print(f"\n🔹 Classifying Chunk #{chunk_index + 1}/{len(chunks)}...")
+
+            # Rank a wider window of upcoming headers locally and show every header from the current one
+            # through the best match (at least SHORTLIST_K of them). The list stays contiguous, so the
+            # prompt's "none skipped" rule and range replies like '1-4' still hold.
+            window = range(last_used_header_index, min(last_used_header_index + SHORTLIST_WINDOW, len(headers)))
+            best_match = max(retriever.shortlist(chunk_text, window, k=1), default=last_used_header_index)
+            last_shown = max(best_match, last_used_header_index + SHORTLIST_K - 1)
+            header_ids = list(range(last_used_header_index, min(last_shown + 1, len(headers))))
+            headers_list = [headers[i] for i in header_ids]
+
+
+            # Ask GPT to select multiple headers, keeping chronological order
+            try:
+                selected_indices = classify_with_gpt(chunk_text, headers_list, key={"chunk_number": chunk_index + 1},
+                                                     use_cascade=use_cascade, structured=structured)
+            except RetryBudgetExhausted:
+                selected_indices = []  # Dead-lettered
+
+            # Adjust indices to reflect actual header positions
+            selected_indices = [header_ids[i] for i in selected_indices if 0 <= i < len(header_ids)]
+            selected_headers = [headers[i] for i in selected_indices]
+
+
+            if not selected_headers:
+                print("⚠️ No headers selected. Skipping this chunk.")
+            else:
+                print(f"✅ Assigned to sections: {selected_headers}")
+
+                # Update the chunk with selected headers
+                chunk["metadata"]["sections"] = selected_headers
+                # Update the last used header index properly; one answer can't jump far ahead,
+                # since the window never moves back
+                last_used_header_index = min(max(selected_indices), last_used_header_index + MAX_HEADER_ADVANCE)
+
+                chunk["metadata"]["last_used_header_index"] = last_used_header_index
+                chunk["metadata"]["chunk_number"] = chunk_index + 1
+
+                # Save progress after each classification
+                save_chunk(journal, chunk_index, chunk)
+
+            chunk_index += 1
+    finally:
+        # Compact whatever was journaled so the JSON output is current even after a crash
+        journal.close()
+        save_chunks(output_file)
+        scheduler.report()
+        if use_cascade:
+            cascade.report()
+        scheduler.write_dead_letters(dead_letter_path(output_file))
 
     print("\n🎉 **All chunks classified successfully!**")
 
-# File paths
-chunk_file = "catalog.json"  # JSON file containing chunks
-header_file = "toc_headers.txt"  # Text file with TOC headers
-output_file = "classified_catalog_agent.json"
-
-# Run classification process
-classify_chunks_with_llm(chunk_file, header_file, output_file)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify catalog chunks into TOC headers with GPT.")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Ask gpt-4o-mini first and escalate to gpt-4o only when it is unsure")
+    parser.add_argument("--structured", action="store_true",
+                        help="Ask for JSON replies whose header numbers are constrained to the candidates by a schema")
+    args = parser.parse_args()
+
+    # File paths
+    chunk_file = "catalog.json"  # JSON file containing chunks
+    header_file = "toc_headers.txt"  # Text file with TOC headers
+    output_file = "classified_catalog_agent.json"
+
+    # Run classification process
+    with metrics.stage("classify"):
+        classify_chunks_with_llm(chunk_file, header_file, output_file, args.cascade, args.structured)
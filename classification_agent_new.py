@@ -1,150 +1,859 @@
+import argparse
+import asyncio
 import json
-import os
+from collections import deque
+
 import openai
 
-client = openai.OpenAI()
+import checkpoint_journal
+from batch_requests import batch_line, load_batch_results, write_batch_file
+from cascade import ModelCascade
+from fast_path import FastPathClassifier
+from header_index import HeaderIndex, load_page_ranges
+from header_retrieval import HeaderRetriever
+from incremental import candidate_fingerprint, prior_classifications
+from llm_cache import LLMCache
+from llm_scheduler import InvalidResponse, RequestScheduler, RetryBudgetExhausted, dead_letter_path
+from metrics import metrics
+from near_duplicates import NEAR_DUPLICATE_THRESHOLD, NearDuplicateIndex, near_duplicate_log_path
+from page_markers import annotate_page_spans, prompt_text
+from structured_output import parse_header_ids, selection_response_format
+
+# Retries are handled by the scheduler, so the clients don't retry on their own
+client = openai.OpenAI(max_retries=0)
+async_client = openai.AsyncOpenAI(max_retries=0)
+cache = LLMCache()  # Replies that parsed correctly, reused across runs
+scheduler = RequestScheduler(requests_per_minute=500, tokens_per_minute=30_000)
+
+MODEL = "gpt-4o"
+TEMPERATURE = 0.2
+CHEAP_MODEL = "gpt-4o-mini"  # First tier when the cascade is enabled
+CASCADE_THRESHOLD = 0.9  # Minimum probability of the cheap model's answer to keep it
+SHORTLIST_K = 8  # Candidate headers kept per prompt after local BM25 ranking; 0 keeps all of them
+cascade = ModelCascade(scheduler, cache, CHEAP_MODEL, MODEL, CASCADE_THRESHOLD, TEMPERATURE)
 
 # Load the list of hierarchical headers with page ranges
 def load_headers(header_file):
-    with open(header_file, "r", encoding="utf-8") as f:
-        return json.load(f)  # Expecting JSON format with "header" and "pages"
+    metrics.record_file(header_file, "read")
+    with metrics.stage("load_headers"):
+        return load_page_ranges(header_file)  # Accepts "start"/"end" ranges or legacy "pages" lists
 
-# Load the JSON data of chunks
+# Load the JSON data of chunks, with each chunk's page span taken from the page markers in the text
 def load_chunks(chunk_file):
-    with open(chunk_file, "r", encoding="utf-8") as f:
-        return json.load(f)
+    metrics.record_file(chunk_file, "read")
+    with metrics.stage("load_chunks"), open(chunk_file, "r", encoding="utf-8") as f:
+        return annotate_page_spans(json.load(f))
+
+# Append a classified chunk to the output file's journal; fill marks a gap retried below the tail
+def save_chunk(journal, chunk_index, chunk, fill=False):
+    journal.append(chunk_index, chunk, fill)
+    print(f"✅ Progress saved: Chunk #{chunk_index + 1} journaled")
 
-# Save classified chunks to the output JSON file
-def save_chunks(output_file, classified_chunks):
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(classified_chunks, f, indent=4)
-    print(f"\n✅ Progress saved to {output_file}")
+# Rebuild the output JSON file from its journal
+def save_chunks(output_file):
+    with metrics.stage("compact"):
+        checkpoint_journal.compact(output_file, indent=4)
 
-# Find the last saved chunk index
+# Find the last saved chunk index from the tail of the journal
 def get_last_saved_index(output_file):
-    if os.path.exists(output_file):
-        with open(output_file, "r", encoding="utf-8") as f:
-            classified_chunks = json.load(f)
-            if classified_chunks:
-                last_used_header_index = classified_chunks[-1]["metadata"].get("last_used_header_index", 0)
-                return len(classified_chunks), last_used_header_index  # Resume from next chunk
+    resume_index, last_chunk = checkpoint_journal.read_tail(checkpoint_journal.journal_path(output_file))
+    if last_chunk:
+        last_used_header_index = last_chunk["metadata"].get("last_used_header_index", 0)
+        return resume_index, last_used_header_index  # Resume from next chunk
     return 0, 0  # Start from the beginning
 
+# Chunk indices a run still has to classify: gaps below the journal's tail left by chunks that
+# were dead-lettered last time, then every chunk after the tail
+def pending_chunk_indices(output_file, chunk_count):
+    resume_index, _ = get_last_saved_index(output_file)
+    missing = checkpoint_journal.missing_indices(checkpoint_journal.journal_path(output_file))
+    if missing:
+        print(f"🔁 Retrying {len(missing)} chunks missing from an earlier run: "
+              f"{', '.join(f'#{i + 1}' for i in missing[:20])}{' …' if len(missing) > 20 else ''}")
+    return missing + list(range(resume_index, chunk_count)), resume_index
+
+# Closing line of a run: dead-lettered chunks are retried by simply running again
+def report_completion(output_file):
+    if scheduler.dead_letters:
+        print(f"\n⚠️ {len(scheduler.dead_letters)} requests were dead-lettered and their chunks are missing from "
+              f"{output_file}; run again to retry them.")
+    else:
+        print("\n🎉 **All chunks classified successfully!**")
+
 import re
 
-def classify_with_gpt(chunk_text, headers):
+def build_messages(chunk_text, headers, structured=False):
+    """
+    Builds the chat messages asking GPT to pick headers for a chunk from the candidate list.
+    With structured, the reply is a JSON object constrained by selection_response_format.
+    """
+    if structured:
+        answer_format = "Respond with the numbers of the selected headers in header_ids, selecting at least one.\n"
+        closing = "Return the selected header numbers."
+    else:
+        answer_format = "Respond ONLY with numbers (e.g., '1-4' or '1,2,3') corresponding to the selected headers.\n"
+        closing = "Return only numbers (e.g., '1-4' or '1,2,3')."
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are an assistant that categorizes text chunks into sections based on a list of ordered headers.\n"
+                "Only classify the text using the provided headers, which are specific to this page range.\n"
+                + answer_format +
+                "If no header seems like a perfect match, select the most relevant one.\n"
+                "Do NOT include explanations or any additional text."
+            )
+        },
+        {
+            "role": "user",
+            "content": (
+                f"Here is a section of text:\n{chunk_text}\n\n"
+                f"Which of these categories does this text belong to? Only select headers from this list:\n"
+                + "\n".join([f"[{i+1}] {header['header']}" for i, header in enumerate(headers)])
+                + f"\n\n{closing}"
+            )
+        }
+    ]
+
+def parse_structured_selection(raw_response, headers):
+    """
+    Returns the header names selected by a structured reply, or None if parse_header_ids rejects it.
+    """
+    numbers = parse_header_ids(raw_response, headers)
+    return None if numbers is None else [headers[number - 1]["header"] for number in numbers]
+
+def parse_numbers(raw_response):
+    """
+    Parses a reply such as '1-4' or '1,2,3' into the listed numbers, or None if it is malformed.
+    """
+    numbers = []
+    try:
+        for part in raw_response.split(","):
+            part = part.strip()
+            if "-" in part:
+                start, end = map(int, part.split("-"))
+                numbers.extend(range(start, end + 1))
+            else:
+                numbers.append(int(part))
+    except ValueError:
+        return None
+    return numbers
+
+def parse_selection(raw_response, headers):
+    """
+    Parses a GPT reply such as '1-4' or '1,2,3' into the selected header names.
+    Returns None if the reply is malformed or selects nothing valid.
+    """
+    selected_indices = parse_numbers(raw_response)
+    if selected_indices is None:
+        return None
+
+    # Convert to zero-based index and filter out-of-range values
+    selected_indices = [i - 1 for i in selected_indices if 0 <= i - 1 < len(headers)]
+    if not selected_indices:
+        return None
+    return [headers[i]["header"] for i in selected_indices]
+
+def consistent_selection(raw_response, headers):
+    """
+    Like parse_selection, but rejects any reply that names a number outside the candidate list.
+    """
+    numbers = parse_numbers(raw_response)
+    if not numbers or any(not 1 <= number <= len(headers) for number in numbers):
+        return None
+    return [headers[number - 1]["header"] for number in numbers]
+
+def cached_selection(messages, headers, parse=parse_selection):
+    """
+    Returns the header selection from a cached reply to these exact messages, or None on a miss.
+    """
+    raw_response = cache.get(MODEL, TEMPERATURE, messages)
+    if raw_response is None:
+        return None
+    print(f"🗄️ Cached GPT Response: {raw_response}")
+    return parse(raw_response, headers)
+
+def selection_validator(messages, headers, parse=parse_selection):
+    """
+    Returns a scheduler validator that turns a reply into header names; unparseable replies are retried.
+    """
+    def validate(response):
+        raw_response = response.choices[0].message.content.strip()
+        print(f"🔹 GPT Response: {raw_response}")  # Debugging output
+
+        selected_headers = parse(raw_response, headers)
+        if not selected_headers:
+            raise InvalidResponse(f"Invalid format received: {raw_response!r}")
+        cache.put(MODEL, TEMPERATURE, messages, raw_response)
+        return selected_headers  # Return valid header selections
+    return validate
+
+def classify_with_gpt(chunk_text, headers, key=None, use_cascade=False, structured=False):
     """
     Uses GPT to classify a text chunk into one or more headers, using only headers matching the chunk's page range.
-    Expects GPT to return numbers corresponding to header indices.
+    Expects GPT to return numbers corresponding to header indices, or with structured, a JSON reply
+    whose header numbers the API constrains to the candidates.
+    With use_cascade, the cheap model answers first and only unsure or inconsistent answers go to MODEL.
+    Raises RetryBudgetExhausted if no valid reply arrives within the scheduler's retry budget.
     """
     if not headers:
         print("⚠️ No matching headers for this page. Assigning to 'Unclassified'.")
         return ["Unclassified"]
 
-    while True:  # Keep asking GPT until the response is formatted correctly
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an assistant that categorizes text chunks into sections based on a list of ordered headers.\n"
-                        "Only classify the text using the provided headers, which are specific to this page range.\n"
-                        "Respond ONLY with numbers (e.g., '1-4' or '1,2,3') corresponding to the selected headers.\n"
-                        "If no header seems like a perfect match, select the most relevant one.\n"
-                        "Do NOT include explanations or any additional text."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Here is a section of text:\n{chunk_text}\n\n"
-                        f"Which of these categories does this text belong to? Only select headers from this list:\n"
-                        + "\n".join([f"[{i+1}] {header['header']}" for i, header in enumerate(headers)])
-                        + "\n\nReturn only numbers (e.g., '1-4' or '1,2,3')."
-                    )
-                }
-            ],
-            temperature=0.2
+    messages = build_messages(chunk_text, headers, structured)
+    format_params = {"response_format": selection_response_format(headers)} if structured else {}
+    parse = parse_structured_selection if structured else parse_selection
+    if use_cascade:
+        def request_for(model, **params):
+            def request():
+                return client.chat.completions.create(model=model, messages=messages, temperature=TEMPERATURE,
+                                                      **format_params, **params)
+            return request
+        consistent = parse_structured_selection if structured else consistent_selection
+        return cascade.run(request_for, messages, lambda raw: consistent(raw, headers), key=key)
+
+    selected_headers = cached_selection(messages, headers, parse)
+    if selected_headers:
+        return selected_headers
+
+    def request():
+        return client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+            **format_params
+        )
+
+    return scheduler.call(request, messages, key=key, validate=selection_validator(messages, headers, parse))
+
+async def classify_with_gpt_async(chunk_text, headers, semaphore, key=None, use_cascade=False, structured=False):
+    """
+    Async counterpart of classify_with_gpt. The semaphore caps how many requests are in flight at once.
+    """
+    if not headers:
+        print("⚠️ No matching headers for this page. Assigning to 'Unclassified'.")
+        return ["Unclassified"]
+
+    messages = build_messages(chunk_text, headers, structured)
+    format_params = {"response_format": selection_response_format(headers)} if structured else {}
+    parse = parse_structured_selection if structured else parse_selection
+    if use_cascade:
+        def request_for(model, **params):
+            async def request():
+                async with semaphore:
+                    return await async_client.chat.completions.create(
+                        model=model, messages=messages, temperature=TEMPERATURE, **format_params, **params)
+            return request
+        consistent = parse_structured_selection if structured else consistent_selection
+        return await cascade.run_async(request_for, messages, lambda raw: consistent(raw, headers), key=key)
+
+    selected_headers = cached_selection(messages, headers, parse)
+    if selected_headers:
+        return selected_headers
+
+    async def request():
+        async with semaphore:
+            return await async_client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+                **format_params
+            )
+
+    return await scheduler.call_async(request, messages, key=key,
+                                      validate=selection_validator(messages, headers, parse))
+
+# Multi-chunk requests: consecutive chunks with the same candidates share one prompt and header list
+PACK_RESPONSE_FORMAT = {"type": "json_object"}
+pack_stats = {"requests": 0, "chunks": 0, "fallbacks": 0}
+
+def build_pack_messages(chunk_texts, headers):
+    """
+    Builds the chat messages asking GPT to pick headers for several chunks at once,
+    answering with one JSON entry per chunk.
+    """
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are an assistant that categorizes text chunks into sections based on a list of ordered headers.\n"
+                "Only classify the text using the provided headers, which are specific to this page range.\n"
+                "Classify every numbered chunk separately. If no header seems like a perfect match, select the most relevant one.\n"
+                "Respond ONLY with a JSON object of the form "
+                "{\"chunks\": [{\"chunk\": 1, \"headers\": \"1-4\"}, {\"chunk\": 2, \"headers\": \"1,2,3\"}]}, "
+                "with one entry per chunk and header numbers from the list."
+            )
+        },
+        {
+            "role": "user",
+            "content": (
+                f"Here are {len(chunk_texts)} sections of text:\n\n"
+                + "\n\n".join(f"[Chunk {i+1}]\n{text}" for i, text in enumerate(chunk_texts))
+                + "\n\nWhich of these categories does each chunk belong to? Only select headers from this list:\n"
+                + "\n".join([f"[{i+1}] {header['header']}" for i, header in enumerate(headers)])
+                + "\n\nReturn only the JSON object."
+            )
+        }
+    ]
+
+def parse_pack_selection(raw_response, headers, chunk_count):
+    """
+    Parses a multi-chunk JSON reply into one header selection per chunk.
+    Chunks with a missing or malformed answer get None.
+    """
+    selections = [None] * chunk_count
+    try:
+        answers = json.loads(raw_response)["chunks"]
+        for answer in answers:
+            position = int(answer["chunk"]) - 1
+            selected = answer["headers"]
+            if isinstance(selected, list):
+                selected = ",".join(str(number) for number in selected)
+            if 0 <= position < chunk_count:
+                selections[position] = parse_selection(str(selected), headers)
+    except (ValueError, KeyError, TypeError):
+        pass
+    return selections
+
+def settle_pack_reply(raw_response, messages, headers, chunk_count):
+    """
+    Splits a multi-chunk reply into per-chunk selections; only fully valid replies are cached.
+    """
+    selections = parse_pack_selection(raw_response, headers, chunk_count)
+    if all(selections):
+        cache.put(MODEL, TEMPERATURE, messages, raw_response, response_format=PACK_RESPONSE_FORMAT)
+    return selections
+
+def cached_pack_selection(messages, headers, chunk_count):
+    raw_response = cache.get(MODEL, TEMPERATURE, messages, response_format=PACK_RESPONSE_FORMAT)
+    if raw_response is None:
+        return None
+    print(f"🗄️ Cached GPT Response: {raw_response}")
+    selections = parse_pack_selection(raw_response, headers, chunk_count)
+    return selections if all(selections) else None
+
+def classify_pack_with_gpt(chunk_texts, headers, keys, structured=False):
+    """
+    Classifies several chunks that share candidate headers with one request.
+    Chunks the packed reply doesn't answer validly are retried as single-chunk requests.
+    Returns one selection per chunk, or None for a chunk that exhausted its retries.
+    """
+    messages = build_pack_messages(chunk_texts, headers)
+    selections = cached_pack_selection(messages, headers, len(chunk_texts))
+    if selections:
+        return selections
+
+    def request():
+        return client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+            response_format=PACK_RESPONSE_FORMAT
         )
 
+    pack_stats["requests"] += 1
+    pack_stats["chunks"] += len(chunk_texts)
+    try:
+        response = scheduler.call(request, messages, key={"chunks": keys},
+                                  completion_tokens=20 * len(chunk_texts))
         raw_response = response.choices[0].message.content.strip()
-        print(f"🔹 GPT Response: {raw_response}")  # Debugging output
+        print(f"🔹 GPT Response: {raw_response}")
+        selections = settle_pack_reply(raw_response, messages, headers, len(chunk_texts))
+    except RetryBudgetExhausted:
+        selections = [None] * len(chunk_texts)
 
-        # Extract numbers using regex
-        selected_indices = []
-        try:
-            for part in raw_response.split(","):
-                part = part.strip()
-                if "-" in part:
-                    start, end = map(int, part.split("-"))
-                    selected_indices.extend(range(start, end + 1))
-                else:
-                    selected_indices.append(int(part))
+    for position, chunk_text in enumerate(chunk_texts):
+        if selections[position] is None:
+            pack_stats["fallbacks"] += 1
+            print(f"↩️ No valid packed answer for {keys[position]}; asking for it alone")
+            try:
+                selections[position] = classify_with_gpt(chunk_text, headers, key=keys[position], structured=structured)
+            except RetryBudgetExhausted:
+                pass  # Dead-lettered
+    return selections
 
-            # Convert to zero-based index and filter out-of-range values
-            selected_indices = [i - 1 for i in selected_indices if 0 <= i - 1 < len(headers)]
+async def classify_pack_with_gpt_async(chunk_texts, headers, keys, semaphore, structured=False):
+    """
+    Async counterpart of classify_pack_with_gpt.
+    """
+    messages = build_pack_messages(chunk_texts, headers)
+    selections = cached_pack_selection(messages, headers, len(chunk_texts))
+    if selections:
+        return selections
 
-            if selected_indices:
-                return [headers[i]["header"] for i in selected_indices]  # Return valid header selections
-        except ValueError:
-            pass  # If parsing fails, retry
+    async def request():
+        async with semaphore:
+            return await async_client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+                response_format=PACK_RESPONSE_FORMAT
+            )
 
-        print("⚠️ Invalid format received. Retrying...")  # Keep prompting until the response is valid
+    pack_stats["requests"] += 1
+    pack_stats["chunks"] += len(chunk_texts)
+    try:
+        response = await scheduler.call_async(request, messages, key={"chunks": keys},
+                                              completion_tokens=20 * len(chunk_texts))
+        raw_response = response.choices[0].message.content.strip()
+        print(f"🔹 GPT Response: {raw_response}")
+        selections = settle_pack_reply(raw_response, messages, headers, len(chunk_texts))
+    except RetryBudgetExhausted:
+        selections = [None] * len(chunk_texts)
 
+    for position, chunk_text in enumerate(chunk_texts):
+        if selections[position] is None:
+            pack_stats["fallbacks"] += 1
+            print(f"↩️ No valid packed answer for {keys[position]}; asking for it alone")
+            try:
+                selections[position] = await classify_with_gpt_async(chunk_text, headers, semaphore, key=keys[position],
+                                                                     structured=structured)
+            except RetryBudgetExhausted:
+                pass  # Dead-lettered
+    return selections
 
-# Main function to classify chunks automatically
-def classify_chunks_with_llm(chunk_file, header_file, output_file):
-    headers = load_headers(header_file)  # Load TOC headers with page ranges
-    chunks = load_chunks(chunk_file)  # Load catalog chunks
-    last_saved_index, last_used_header_index = get_last_saved_index(output_file)  # Resume from last point
+def report_packing():
+    if pack_stats["requests"]:
+        print(
+            f"📦 Packed {pack_stats['chunks']} chunks into {pack_stats['requests']} requests; "
+            f"{pack_stats['fallbacks']} fell back to single-chunk requests"
+        )
+
+# Filter headers that match the chunk's pages
+def find_matching_headers(header_index, chunk):
+    first_page, last_page = chunk["metadata"].get("page_span") or (chunk["metadata"]["page_number"],) * 2
+    return header_index.covering_range(first_page, last_page)
+
+class HeaderLookup:
+    """
+    Picks each chunk's candidate headers (those covering its pages, narrowed by the local BM25
+    shortlist) and resolves the chunks that need no model call at all: chunks carried forward
+    unchanged from a previous output, then those the rule-based fast path can decide, then (once
+    index_near_duplicates is called) near-duplicates of chunks already classified.
+    """
+
+    def __init__(self, headers, shortlist_k=SHORTLIST_K, use_fast_path=True, previous_output=None,
+                 previous_header_file=None):
+        self.headers = headers
+        self.index = HeaderIndex(headers)  # Page -> covering headers lookup
+        self.retriever = HeaderRetriever([h["header"] for h in headers], top_k=shortlist_k) if shortlist_k else None
+        self.fast_path = FastPathClassifier(headers) if use_fast_path else None
+        self.prior = prior_classifications(previous_output, previous_header_file, headers) if previous_output else None
+        self.near_duplicates = None
+
+    def index_near_duplicates(self, chunks, output_file, threshold=NEAR_DUPLICATE_THRESHOLD):
+        """
+        Builds the MinHash/LSH index over the chunks and registers those already classified in
+        the output's journal, so a resumed run can reuse them too.
+        """
+        with metrics.stage("index_near_duplicates"):
+            self.near_duplicates = NearDuplicateIndex(chunks, threshold, near_duplicate_log_path(output_file))
+            for chunk in checkpoint_journal.replay(checkpoint_journal.journal_path(output_file)):
+                self.near_duplicates.add(chunk)
 
-    # If progress exists, load classified chunks; otherwise, start fresh
-    classified_chunks = []
-    if last_saved_index > 0:
-        with open(output_file, "r", encoding="utf-8") as f:
-            classified_chunks = json.load(f)
+    def record(self, chunk):
+        """
+        Makes a classified chunk's sections available to its near-duplicates.
+        """
+        if self.near_duplicates is not None:
+            self.near_duplicates.add(chunk)
 
-    chunk_index = last_saved_index  # Resume from the next chunk
+    def matching(self, chunk):
+        return find_matching_headers(self.index, chunk)
 
-    while chunk_index < len(chunks):
+    def fingerprint(self, chunk):
+        return candidate_fingerprint(self.matching(chunk))
+
+    def section_ids(self, chunk, selected_headers):
+        """
+        Maps selected header names to TOC ids, resolving repeated TOC paths among the chunk's candidates.
+        """
+        ids = {}
+        for header in self.matching(chunk):
+            ids.setdefault(header["header"], header["id"])
+        return [ids[name] for name in selected_headers if name in ids]
+
+    def candidates(self, chunk):
+        matching_headers = self.matching(chunk)
+        if self.retriever is None:
+            return matching_headers
+        keep = set(self.retriever.shortlist(prompt_text(chunk), [h["id"] for h in matching_headers]))
+        return [h for h in matching_headers if h["id"] in keep]
+
+    def resolve_locally(self, chunk, chunk_index=None, reuse_near_duplicates=True):
+        """
+        Returns the chunk's header names if they can be decided without the model, else None.
+        With reuse_near_duplicates=False the caller looks near-duplicates up itself, through
+        reuse_near_duplicate, once the chunks before this one are recorded.
+        """
+        if self.prior is not None:
+            prior = self.prior.get(chunk["id"], self.fingerprint(chunk))
+            if prior is not None:
+                return prior["metadata"]["sections"]
+        if self.fast_path is not None:
+            resolved = self.fast_path.classify(prompt_text(chunk), self.matching(chunk))
+            if resolved:
+                return [h["header"] for h in resolved]
+        if reuse_near_duplicates:
+            return self.reuse_near_duplicate(chunk, chunk_index)
+        return None
+
+    def reuse_near_duplicate(self, chunk, chunk_index=None):
+        """
+        Returns the header names of a recorded near-duplicate of the chunk, or None.
+        """
+        if self.near_duplicates is None:
+            return None
+        chunk_number = chunk_index + 1 if chunk_index is not None else None
+        return self.near_duplicates.reuse(chunk, self.matching(chunk), chunk_number)
+
+    def report(self):
+        if self.prior is not None:
+            self.prior.report()
+        if self.fast_path is not None:
+            self.fast_path.report()
+        if self.near_duplicates is not None:
+            self.near_duplicates.report()
+
+# Load headers along with the lookups used to pick candidates
+def load_header_lookup(header_file, **lookup_options):
+    return HeaderLookup(load_headers(header_file), **lookup_options)  # Load TOC headers with page ranges
+
+def group_chunks(chunks, pending_indices, lookup, pack_size=1):
+    """
+    Yields (chunk_indices, resolved_headers, candidate_headers) for consecutive groups of the
+    pending chunks.
+    A chunk the fast path resolves is yielded alone with its resolved headers. Otherwise up to
+    pack_size adjacent chunks covered by the same headers are grouped, with the union of their
+    shortlisted candidates in TOC order.
+    Near-duplicates are looked up only after the previous group has been yielded, so a consumer
+    that records each group before asking for the next lets a chunk reuse the one right before it.
+    """
+    group, group_key = [], None
+
+    def flush():
+        keep = {h["id"] for chunk_index in group for h in lookup.candidates(chunks[chunk_index])}
+        return list(group), None, [h for h in lookup.matching(chunks[group[0]]) if h["id"] in keep]
+
+    for chunk_index in pending_indices:
         chunk = chunks[chunk_index]
-        chunk_text = chunk["text"]
-        chunk_page = chunk["metadata"]["page_number"]
+        selected_headers = lookup.resolve_locally(chunk, chunk_index, reuse_near_duplicates=False)
+        key = None if selected_headers else tuple(h["id"] for h in lookup.matching(chunk))
+        if group and (not key or key != group_key or len(group) >= pack_size):
+            yield flush()
+            group = []
+        if not selected_headers:
+            selected_headers = lookup.reuse_near_duplicate(chunk, chunk_index)
+            if selected_headers and group:
+                yield flush()  # Keeps the output in chunk order
+                group = []
+        if selected_headers:
+            yield [chunk_index], selected_headers, None
+            continue
+        group.append(chunk_index)
+        group_key = key
+    if group:
+        yield flush()
+
+# Identifies a chunk in dead-letter records and retry logs
+def chunk_key(chunk_index, chunk):
+    return {"chunk_number": chunk_index + 1, "id": chunk["id"]}
 
-        # Filter headers that match the current chunk's page number
-        matching_headers = [h for h in headers if chunk_page in h["pages"]]
+# Record the selected headers (names and TOC ids) on a chunk once it has been classified, with the
+# fingerprint of its candidate headers so an incremental run can tell whether a TOC change affects it
+def apply_classification(chunk, chunk_index, selected_headers, lookup=None):
+    if not selected_headers or selected_headers == ["Unclassified"]:
+        print("⚠️ No headers matched. Assigning to 'Unclassified'.")
+        selected_headers = ["Unclassified"]
+    else:
+        print(f"✅ Assigned to sections: {selected_headers}")
 
-        print(f"\n🔹 Classifying Chunk #{chunk_index + 1}/{len(chunks)} on page {chunk_page}...")
+    chunk["metadata"]["sections"] = selected_headers
+    chunk["metadata"]["last_used_header_index"] = chunk_index
+    chunk["metadata"]["chunk_number"] = chunk_index + 1
+    if lookup is not None:
+        chunk["metadata"]["section_ids"] = lookup.section_ids(chunk, selected_headers)
+        chunk["metadata"]["candidate_fingerprint"] = lookup.fingerprint(chunk)
+        lookup.record(chunk)
 
+# Classify one group from group_chunks; returns a selection per chunk (None if dead-lettered)
+def classify_group(chunks, chunk_indices, selected_headers, matching_headers, use_cascade=False, structured=False):
+    if selected_headers:
+        print("⚡ Resolved locally")
+        return [selected_headers]
+    keys = [chunk_key(chunk_index, chunks[chunk_index]) for chunk_index in chunk_indices]
+    if len(chunk_indices) > 1:
+        return classify_pack_with_gpt([prompt_text(chunks[i]) for i in chunk_indices], matching_headers, keys, structured)
+    try:
         # Ask GPT to classify using only headers for this page
-        selected_headers = classify_with_gpt(chunk_text, matching_headers)
+        return [classify_with_gpt(prompt_text(chunks[chunk_indices[0]]), matching_headers, key=keys[0],
+                                  use_cascade=use_cascade, structured=structured)]
+    except RetryBudgetExhausted:
+        return [None]
 
-        if not selected_headers or selected_headers == ["Unclassified"]:
-            print("⚠️ No headers matched. Assigning to 'Unclassified'.")
-            selected_headers = ["Unclassified"]
-        else:
-            print(f"✅ Assigned to sections: {selected_headers}")
+async def classify_group_async(chunks, chunk_indices, matching_headers, semaphore, use_cascade=False,
+                               structured=False):
+    keys = [chunk_key(chunk_index, chunks[chunk_index]) for chunk_index in chunk_indices]
+    if len(chunk_indices) > 1:
+        return await classify_pack_with_gpt_async(
+            [prompt_text(chunks[i]) for i in chunk_indices], matching_headers, keys, semaphore, structured)
+    try:
+        return [await classify_with_gpt_async(prompt_text(chunks[chunk_indices[0]]), matching_headers, semaphore,
+                                              key=keys[0], use_cascade=use_cascade, structured=structured)]
+    except RetryBudgetExhausted:
+        return [None]
 
-        # Update the chunk with selected headers
-        chunk["metadata"]["sections"] = selected_headers
-        chunk["metadata"]["last_used_header_index"] = chunk_index
-        chunk["metadata"]["chunk_number"] = chunk_index + 1
+def describe_group(chunk_indices, total):
+    if len(chunk_indices) == 1:
+        return f"Chunk #{chunk_indices[0] + 1}/{total}"
+    return f"Chunks #{chunk_indices[0] + 1}-{chunk_indices[-1] + 1}/{total}"
 
-        classified_chunks.append(chunk)
+# Main function to classify chunks automatically
+def classify_chunks_with_llm(chunk_file, header_file, output_file, pack_size=1, use_cascade=False, structured=False,
+                             near_duplicate_threshold=None, **lookup_options):
+    lookup = load_header_lookup(header_file, **lookup_options)  # Page -> candidate headers lookup
+    chunks = load_chunks(chunk_file)  # Load catalog chunks
+    if near_duplicate_threshold:
+        lookup.index_near_duplicates(chunks, output_file, near_duplicate_threshold)
+    journal = checkpoint_journal.open_journal(output_file)  # Seeds from a pre-journal output file if needed
+    pending_indices, last_saved_index = pending_chunk_indices(output_file, len(chunks))  # Resume from last point
 
-        # Save progress after each classification
-        save_chunks(output_file, classified_chunks)
+    try:
+        # Consecutive chunks with the same candidate headers share a request when pack_size > 1
+        for chunk_indices, selected_headers, matching_headers in group_chunks(chunks, pending_indices, lookup, pack_size):
+            chunk_page = chunks[chunk_indices[0]]["metadata"]["page_number"]
+            print(f"\n🔹 Classifying {describe_group(chunk_indices, len(chunks))} on page {chunk_page}...")
 
-        chunk_index += 1
+            selections = classify_group(chunks, chunk_indices, selected_headers, matching_headers, use_cascade,
+                                        structured)
+            for chunk_index, selected_headers in zip(chunk_indices, selections):
+                if selected_headers is None:
+                    continue  # Dead-lettered; left out of the output
+                chunk = chunks[chunk_index]
 
-    print("\n🎉 **All chunks classified successfully!**")
+                # Update the chunk with selected headers
+                apply_classification(chunk, chunk_index, selected_headers, lookup)
 
+                # Save progress after each classification
+                save_chunk(journal, chunk_index, chunk, fill=chunk_index < last_saved_index)
+    finally:
+        # Compact whatever was journaled so the JSON output is current even after a crash
+        journal.close()
+        save_chunks(output_file)
+        lookup.report()
+        report_packing()
+        if use_cascade:
+            cascade.report()
+        cache.report()
+        scheduler.report()
+        scheduler.write_dead_letters(dead_letter_path(output_file))
 
-# File paths
-chunk_file = "catalog.json"  # JSON file containing chunks
-header_file = "toc_headers_with_page_ranges.json"  # JSON file with TOC headers and full page ranges
-output_file = "classified_catalog_agent_new.json"
+    report_completion(output_file)
 
-# Run classification process
-classify_chunks_with_llm(chunk_file, header_file, output_file)
+
+# Async variant: keeps up to max_in_flight requests open and commits results in chunk order
+async def classify_chunks_with_llm_async(chunk_file, header_file, output_file, max_in_flight=8, pack_size=1,
+                                         use_cascade=False, structured=False, near_duplicate_threshold=None,
+                                         **lookup_options):
+    lookup = load_header_lookup(header_file, **lookup_options)  # Page -> candidate headers lookup
+    chunks = load_chunks(chunk_file)  # Load catalog chunks
+    if near_duplicate_threshold:
+        # Chunks still in flight are not registered yet, so the async mode finds fewer reuses
+        lookup.index_near_duplicates(chunks, output_file, near_duplicate_threshold)
+    journal = checkpoint_journal.open_journal(output_file)
+    pending_indices, last_saved_index = pending_chunk_indices(output_file, len(chunks))  # Resume from last point
+
+    semaphore = asyncio.Semaphore(max_in_flight)
+    # Queue a few times more tasks than the semaphore admits so a slow head-of-line
+    # request never leaves the remaining slots idle while we wait to commit it
+    lookahead = max_in_flight * 4
+    pending = deque()
+    groups = group_chunks(chunks, pending_indices, lookup, pack_size)
+    exhausted = False
+
+    try:
+        while not exhausted or pending:
+            while not exhausted and len(pending) < lookahead:
+                group = next(groups, None)
+                if group is None:
+                    exhausted = True
+                    break
+                chunk_indices, selected_headers, matching_headers = group
+                if selected_headers:
+                    # Already decided; queue it as a finished future so commits stay in order
+                    task = asyncio.get_running_loop().create_future()
+                    task.set_result([selected_headers])
+                else:
+                    task = asyncio.create_task(classify_group_async(
+                        chunks, chunk_indices, matching_headers, semaphore, use_cascade, structured))
+                pending.append((chunk_indices, task))
+
+            if not pending:
+                break
+            chunk_indices, task = pending.popleft()
+            selections = await task
+            for chunk_index, selected_headers in zip(chunk_indices, selections):
+                if selected_headers is None:
+                    continue  # Dead-lettered; left out of the output
+                chunk = chunks[chunk_index]
+
+                print(f"\n🔹 Classified Chunk #{chunk_index + 1}/{len(chunks)} on page {chunk['metadata']['page_number']}")
+                apply_classification(chunk, chunk_index, selected_headers, lookup)
+
+                # Save progress after each committed classification
+                save_chunk(journal, chunk_index, chunk, fill=chunk_index < last_saved_index)
+    finally:
+        # Anything still queued is discarded; a rerun resumes from the last committed chunk
+        for _, task in pending:
+            task.cancel()
+        journal.close()
+        save_chunks(output_file)
+        lookup.report()
+        report_packing()
+        if use_cascade:
+            cascade.report()
+        cache.report()
+        scheduler.report()
+        scheduler.write_dead_letters(dead_letter_path(output_file))
+
+    report_completion(output_file)
+
+
+# Batch API mode: one request line per chunk, keyed by chunk number and chunk id
+def batch_custom_id(chunk_index, chunk):
+    return f"classify-{chunk_index + 1}-{chunk['id']}"
+
+def build_classification_batch(chunk_file, header_file, batch_file, chunk_indices=None, structured=False,
+                               **lookup_options):
+    """
+    Writes an OpenAI Batch API request file instead of calling the API inline.
+    Chunks without candidate headers, or resolved by the fast path, need no request.
+    """
+    lookup = load_header_lookup(header_file, **lookup_options)
+    chunks = load_chunks(chunk_file)
+    if chunk_indices is None:
+        chunk_indices = range(len(chunks))
+
+    def lines():
+        for chunk_index in chunk_indices:
+            chunk = chunks[chunk_index]
+            if lookup.resolve_locally(chunk):
+                continue
+            matching_headers = lookup.candidates(chunk)
+            if matching_headers:
+                messages = build_messages(prompt_text(chunk), matching_headers, structured)
+                format_params = {"response_format": selection_response_format(matching_headers)} if structured else {}
+                yield batch_line(batch_custom_id(chunk_index, chunk), MODEL, messages, temperature=TEMPERATURE,
+                                 **format_params)
+
+    return write_batch_file(batch_file, lines())
+
+def ingest_classification_batch(chunk_file, header_file, results_files, output_file, retry_batch_file,
+                                structured=False, **lookup_options):
+    """
+    Validates batch replies and merges them into the classified catalog in chunk order.
+    Chunks whose reply is missing or malformed are left out and written to a retry batch file;
+    ingesting again with the retry results appended fills them in.
+    Use the same lookup and structured options as the build step so reply indices map onto the same candidates.
+    """
+    parse = parse_structured_selection if structured else parse_selection
+    lookup = load_header_lookup(header_file, **lookup_options)
+    chunks = load_chunks(chunk_file)
+    results = load_batch_results(results_files)
+
+    failed_indices = []
+    journal = checkpoint_journal.open_journal(output_file)
+    try:
+        journal.remove_from(0)  # The batch results replace any earlier progress
+        for chunk_index, chunk in enumerate(chunks):
+            selected_headers = lookup.resolve_locally(chunk)
+            matching_headers = [] if selected_headers else lookup.candidates(chunk)
+            if matching_headers:
+                raw_response = results.get(batch_custom_id(chunk_index, chunk))
+                selected_headers = parse(raw_response, matching_headers) if raw_response else None
+                if not selected_headers:
+                    failed_indices.append(chunk_index)
+                    continue
+                # Seed the cache so inline reruns of the same prompt are free
+                cache.put(MODEL, TEMPERATURE, build_messages(prompt_text(chunk), matching_headers, structured),
+                          raw_response)
+
+            apply_classification(chunk, chunk_index, selected_headers, lookup)
+            journal.append(chunk_index, chunk)
+    finally:
+        journal.close()
+        save_chunks(output_file)
+
+    if failed_indices:
+        print(f"⚠️ {len(failed_indices)} chunks had missing or invalid batch replies.")
+        build_classification_batch(chunk_file, header_file, retry_batch_file, failed_indices, structured,
+                                   **lookup_options)
+    else:
+        print("\n🎉 **All chunks classified successfully!**")
+    return failed_indices
+
+
+if __name__ == "__main__":
+    # File paths
+    chunk_file = "catalog.json"  # JSON file containing chunks
+    header_file = "toc_headers_with_page_ranges.json"  # JSON file with TOC headers and full page ranges
+    output_file = "classified_catalog_agent_new.json"
+
+    parser = argparse.ArgumentParser(description="Classify catalog chunks into TOC sections with GPT.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Classify chunks concurrently with AsyncOpenAI")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="Maximum number of concurrent requests in async mode")
+    parser.add_argument("--shortlist-k", type=int, default=SHORTLIST_K,
+                        help="Send only the k best locally ranked candidate headers per chunk (0 sends all)")
+    parser.add_argument("--no-fast-path", dest="use_fast_path", action="store_false",
+                        help="Send every chunk to the model instead of resolving unambiguous ones locally")
+    parser.add_argument("--pack-size", type=int, default=1,
+                        help="Classify up to this many consecutive chunks with the same candidate headers per request")
+    parser.add_argument("--cascade", action="store_true",
+                        help=f"Ask {CHEAP_MODEL} first and escalate to {MODEL} only when it is unsure")
+    parser.add_argument("--cascade-threshold", type=float, default=CASCADE_THRESHOLD,
+                        help="Minimum probability of the cheap model's answer to keep it")
+    parser.add_argument("--structured", action="store_true",
+                        help="Ask for JSON replies whose header numbers are constrained to the candidates by a schema")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="Reuse the sections of an already classified near-duplicate chunk instead of asking the model")
+    parser.add_argument("--near-duplicate-threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD,
+                        help="Minimum estimated Jaccard similarity of word shingles for --near-duplicates")
+    parser.add_argument("--previous-output", metavar="OUTPUT_FILE",
+                        help="Incremental run: reuse classifications of chunks whose id and candidate headers are unchanged")
+    parser.add_argument("--previous-toc", metavar="HEADER_FILE",
+                        help="TOC the previous output was classified with; needed for outputs without fingerprints")
+    parser.add_argument("--build-batch", metavar="BATCH_FILE",
+                        help="Write an OpenAI Batch API request file instead of calling the API")
+    parser.add_argument("--ingest-batch", metavar="RESULTS_FILE", nargs="+",
+                        help="Merge Batch API results files (later files override earlier ones) into the output")
+    parser.add_argument("--retry-batch", metavar="BATCH_FILE", default="classification_batch_retry.jsonl",
+                        help="Where --ingest-batch writes requests for chunks that need another try")
+    args = parser.parse_args()
+
+    lookup_options = {
+        "shortlist_k": args.shortlist_k,
+        "use_fast_path": args.use_fast_path,
+        "previous_output": args.previous_output,
+        "previous_header_file": args.previous_toc,
+    }
+
+    cascade.threshold = args.cascade_threshold
+    near_duplicate_threshold = args.near_duplicate_threshold if args.near_duplicates else None
+
+    # Run classification process
+    with metrics.stage("classify"):
+        if args.build_batch:
+            build_classification_batch(chunk_file, header_file, args.build_batch, structured=args.structured,
+                                       **lookup_options)
+        elif args.ingest_batch:
+            ingest_classification_batch(chunk_file, header_file, args.ingest_batch, output_file, args.retry_batch,
+                                        args.structured, **lookup_options)
+        elif args.use_async:
+            asyncio.run(classify_chunks_with_llm_async(chunk_file, header_file, output_file, args.max_in_flight,
+                                                       args.pack_size, args.cascade, args.structured,
+                                                       near_duplicate_threshold, **lookup_options))
+        else:
+            classify_chunks_with_llm(chunk_file, header_file, output_file, args.pack_size, args.cascade,
+                                     args.structured, near_duplicate_threshold, **lookup_options)
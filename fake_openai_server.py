@@ -0,0 +1,183 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HEADER_LINE = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+CHUNK_LINE = re.compile(r"^\[Chunk (\d+)\]", re.MULTILINE)
+
+class FakeOpenAIConfig:
+    """
+    Behavior of the fake endpoint: lognormal latency around latency_ms (spread by latency_sigma),
+    and the fraction of requests answered with a 429 or with a malformed reply.
+    """
+
+    def __init__(self, latency_ms=300.0, latency_sigma=0.5, rate_limit_rate=0.0, retry_after_ms=200,
+                 malformed_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+
+    def latency(self):
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+def count_tokens(text):
+    # Same rough estimate as llm_scheduler.estimate_tokens
+    return len(text) // 4 + 1
+
+def fake_reply(body, malformed=False):
+    """
+    Produces a plausible reply for the repo's prompts: header numbers for classification prompts
+    (as JSON when a schema is requested), per-chunk JSON for packed prompts, and a short summary otherwise.
+    """
+    if body.get("response_format", {}).get("type") == "json_schema":
+        return json.dumps({"header_ids": [1]})
+    if malformed:
+        return "I think the first header fits best."
+    prompt = body["messages"][-1].get("content") or ""
+    if body.get("response_format", {}).get("type") == "json_object":
+        chunk_count = len(CHUNK_LINE.findall(prompt)) or 1
+        return json.dumps({"chunks": [{"chunk": i + 1, "headers": "1"} for i in range(chunk_count)]})
+    if HEADER_LINE.search(prompt):
+        return "1"
+    return "Undergraduate Programs of Study: Example Department (Overview, Requirements)."
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    Local stand-in for POST /v1/chat/completions. GET /stats returns the request and token counters.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "malformed": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output quiet
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        config = self.server.config
+        with self.server.lock:
+            latency = config.latency()
+            rate_limited = config.random.random() < config.rate_limit_rate
+            malformed = config.random.random() < config.malformed_rate
+        time.sleep(latency)
+
+        if rate_limited:
+            self.server.count(requests=1, rate_limited=1)
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after-ms": str(config.retry_after_ms)},
+            )
+            return
+
+        if body.get("response_format", {}).get("type") == "json_schema":
+            malformed = False  # A strict schema rules out malformed replies
+        content = fake_reply(body, malformed)
+        prompt_tokens = sum(count_tokens(message.get("content") or "") for message in body.get("messages", []))
+        completion_tokens = count_tokens(content)
+        self.server.count(requests=1, malformed=int(malformed), prompt_tokens=prompt_tokens,
+                          completion_tokens=completion_tokens)
+
+        logprobs = None
+        if body.get("logprobs"):
+            # One token per reply character is enough for confidence checks
+            logprobs = {"content": [
+                {"token": char, "logprob": -0.01, "bytes": list(char.encode("utf-8")), "top_logprobs": []}
+                for char in content
+            ]}
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "logprobs": logprobs,
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+def start_server(config, host="127.0.0.1", port=0):
+    """
+    Starts the fake server on a background thread; port 0 picks a free port. Returns the server.
+    """
+    server = FakeOpenAIServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI chat completions endpoint for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Median response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Lognormal spread of the latency")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after-ms", type=int, default=200, help="Retry-After hint sent with a 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of replies that are malformed")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(args.latency_ms, args.latency_sigma, args.rate_limit_rate, args.retry_after_ms,
+                              args.malformed_rate, args.seed)
+    server = FakeOpenAIServer((args.host, args.port), config)
+    print(f"🧪 Fake OpenAI endpoint at {server.base_url} (set OPENAI_BASE_URL to use it)")
+    server.serve_forever()
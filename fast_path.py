@@ -0,0 +1,137 @@
+import re
+from collections import deque
+
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+def normalize(text):
+    """
+    Lowercases and collapses punctuation/whitespace so titles match regardless of formatting.
+    """
+    return NON_WORD.sub(" ", text.lower()).strip()
+
+def leaf_titles(headers):
+    """
+    Returns the last component of each header path. The parent is found by walking back through
+    the TOC-ordered headers, so titles that contain commas are kept whole.
+    """
+    titles = []
+    stack = []  # Paths of the current ancestors
+    for header in headers:
+        path = header["header"]
+        while stack and not path.startswith(stack[-1] + ", "):
+            stack.pop()
+        titles.append(header.get("title") or (path[len(stack[-1]) + 2:] if stack else path))
+        stack.append(path)
+    return titles
+
+class AhoCorasick:
+    """
+    Multi-pattern matcher: finds every occurrence of any pattern in one pass over the text.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]  # (pattern length, value) pairs ending at each node
+        for pattern, value in patterns:
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.outputs[node].append((len(pattern), value))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def find_all(self, text):
+        """
+        Yields (start, end, value) for every pattern occurrence in the text.
+        """
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, value in self.outputs[node]:
+                yield position - length + 1, position + 1, value
+
+class FastPathClassifier:
+    """
+    Resolves chunks without the LLM when the answer is unambiguous:
+    - the chunk's page is covered by exactly one header, or
+    - the chunk opens with a line that is exactly (after normalization) the leaf title of one of
+      its candidate headers, and every candidate title found on its own line maps to one header.
+    Everything else is left for the model.
+    """
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.titles = {header["id"]: normalize(title) for title, header in zip(leaf_titles(headers), headers)}
+        self.matcher = AhoCorasick((title, header_id) for header_id, title in self.titles.items() if title)
+        self.resolved_single = 0
+        self.resolved_title = 0
+        self.deferred = 0
+
+    def heading_matches(self, chunk_text):
+        """
+        Returns the header ids whose title fills a whole line of the chunk, and the ids that
+        match the chunk's first non-empty line.
+        """
+        lines = [normalize(line) for line in chunk_text.splitlines()]
+        lines = [line for line in lines if line]
+        text = "\n".join(lines)
+        first_line_end = len(lines[0]) if lines else 0
+
+        heading_ids, first_line_ids = set(), set()
+        for start, end, header_id in self.matcher.find_all(text):
+            starts_line = start == 0 or text[start - 1] == "\n"
+            ends_line = end == len(text) or text[end] == "\n"
+            if starts_line and ends_line:
+                heading_ids.add(header_id)
+                if start == 0 and end == first_line_end:
+                    first_line_ids.add(header_id)
+        return heading_ids, first_line_ids
+
+    def classify(self, chunk_text, candidates):
+        """
+        Returns the resolved candidate headers in TOC order, or None if the chunk is ambiguous.
+        """
+        if len(candidates) == 1:
+            self.resolved_single += 1
+            return list(candidates)
+
+        if candidates:
+            heading_ids, first_line_ids = self.heading_matches(chunk_text)
+            candidate_ids = {header["id"] for header in candidates}
+            opening = first_line_ids & candidate_ids
+            matched = [header for header in candidates if header["id"] in heading_ids]
+            titles = [self.titles[header["id"]] for header in matched]
+            # The same title under two candidate parents (e.g. "FRESHMAN YEAR") is ambiguous
+            if len(opening) == 1 and len(set(titles)) == len(titles):
+                self.resolved_title += 1
+                return matched
+
+        self.deferred += 1
+        return None
+
+    def report(self):
+        total = self.resolved_single + self.resolved_title + self.deferred
+        resolved = self.resolved_single + self.resolved_title
+        if total:
+            print(
+                f"⚡ Resolved {resolved}/{total} chunks locally ({resolved / total:.0%}): "
+                f"{self.resolved_single} single-candidate pages, {self.resolved_title} title matches; "
+                f"{self.deferred} sent to the model"
+            )
@@ -0,0 +1,94 @@
+import json
+from bisect import bisect_right
+
+def page_runs(pages):
+    """
+    Collapses a list of page numbers into sorted (start, end) runs of consecutive pages.
+    """
+    runs = []
+    for page in sorted(set(pages)):
+        if runs and page == runs[-1][1] + 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return [tuple(run) for run in runs]
+
+def normalize_header_entry(entry):
+    """
+    Returns the (start, end) page ranges of a TOC entry, accepting both the compact
+    {"start", "end"} format and the older expanded {"pages": [...]} format.
+    """
+    if "start" in entry:
+        return [(entry["start"], entry["end"])]
+    return page_runs(entry.get("pages", []))
+
+def load_page_ranges(header_file):
+    """
+    Loads TOC headers with page ranges. Every entry gets an "id" (its position in the TOC)
+    and "start"/"end" pages; old files with expanded "pages" lists are converted on load.
+    """
+    with open(header_file, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    headers = []
+    for i, entry in enumerate(entries):
+        runs = normalize_header_entry(entry)
+        header = {key: value for key, value in entry.items() if key != "pages"}
+        header.setdefault("id", i)
+        if runs:
+            header["start"], header["end"] = runs[0][0], runs[-1][1]
+        header["ranges"] = runs
+        headers.append(header)
+    return headers
+
+class HeaderIndex:
+    """
+    Answers "which headers cover page p" in O(log n + k).
+    The page axis is cut into elementary segments at every range boundary; each segment
+    stores the ids of the headers covering it, so a lookup is one bisect plus the result.
+    """
+
+    def __init__(self, headers):
+        self.headers = headers
+        events = []
+        for position, header in enumerate(headers):
+            for start, end in header.get("ranges") or normalize_header_entry(header):
+                events.append((start, position, True))
+                events.append((end + 1, position, False))
+        events.sort()
+
+        self._boundaries = []  # First page of each segment
+        self._segments = []  # Header positions covering that segment, in TOC order
+        active = set()
+        i = 0
+        while i < len(events):
+            page = events[i][0]
+            while i < len(events) and events[i][0] == page:
+                _, position, opening = events[i]
+                if opening:
+                    active.add(position)
+                else:
+                    active.discard(position)
+                i += 1
+            self._boundaries.append(page)
+            self._segments.append(tuple(sorted(active)))
+
+    def covering(self, page):
+        """
+        Returns the headers whose page range includes the page, in TOC order.
+        """
+        segment = bisect_right(self._boundaries, page) - 1
+        if segment < 0:
+            return []
+        return [self.headers[position] for position in self._segments[segment]]
+
+    def covering_range(self, first_page, last_page):
+        """
+        Returns the headers that cover any page between first_page and last_page, in TOC order.
+        """
+        first = max(bisect_right(self._boundaries, first_page) - 1, 0)
+        last = bisect_right(self._boundaries, last_page)
+        positions = set()
+        for segment in self._segments[first:last]:
+            positions.update(segment)
+        return [self.headers[position] for position in sorted(positions)]
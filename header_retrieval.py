@@ -0,0 +1,72 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+class HeaderRetriever:
+    """
+    Local BM25 ranking of TOC headers against chunk text, used to shrink the candidate list
+    sent to the model. The header-by-term weight matrix is built once; scoring a chunk is a
+    column gather and a row sum over the candidate rows.
+    """
+
+    def __init__(self, headers, top_k=8, k1=1.2, b=0.75):
+        self.headers = list(headers)
+        self.top_k = top_k
+        self.vocabulary = {}
+
+        rows, cols, counts = [], [], []
+        for row, header in enumerate(self.headers):
+            for token, count in Counter(tokenize(header)).items():
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+                counts.append(count)
+
+        term_counts = np.zeros((len(self.headers), max(len(self.vocabulary), 1)), dtype=np.float32)
+        term_counts[rows, cols] = counts
+
+        doc_lengths = term_counts.sum(axis=1)
+        avg_length = doc_lengths.mean() if len(self.headers) else 1.0
+        doc_freq = (term_counts > 0).sum(axis=0)
+        idf = np.log1p((len(self.headers) - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))
+        self.weights = (idf * term_counts * (k1 + 1) / (term_counts + norm[:, None])).astype(np.float32)
+
+    @classmethod
+    def from_file(cls, header_file, **kwargs):
+        """
+        Builds a retriever over a TOC header text file such as toc_headers.txt (one header per line).
+        """
+        with open(header_file, "r", encoding="utf-8") as f:
+            return cls([line.strip() for line in f if line.strip()], **kwargs)
+
+    def scores(self, text, candidate_ids):
+        """
+        Returns the BM25 score of each candidate header row for the text.
+        """
+        term_ids = sorted({self.vocabulary[token] for token in tokenize(text) if token in self.vocabulary})
+        candidate_ids = np.asarray(candidate_ids, dtype=np.intp)
+        if not term_ids:
+            return np.zeros(len(candidate_ids), dtype=np.float32)
+        return self.weights[np.ix_(candidate_ids, term_ids)].sum(axis=1)
+
+    def shortlist(self, text, candidate_ids, k=None, always_include=()):
+        """
+        Keeps the k best-scoring candidates (plus any in always_include), returned in their
+        original TOC order so the prompt stays chronological.
+        """
+        k = self.top_k if k is None else k
+        candidate_ids = list(candidate_ids)
+        if len(candidate_ids) <= k:
+            return candidate_ids
+
+        scores = self.scores(text, candidate_ids)
+        # Stable sort so ties keep TOC order
+        best = np.argsort(-scores, kind="stable")[:k]
+        keep = {candidate_ids[i] for i in best} | set(always_include)
+        return [header_id for header_id in candidate_ids if header_id in keep]
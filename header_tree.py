@@ -0,0 +1,151 @@
+import json
+
+class HeaderNode:
+    """
+    One TOC entry. The id is its position in the TOC, so ids are stable for a given TOC file.
+    """
+
+    __slots__ = ("id", "title", "level", "header", "parent", "children")
+
+    def __init__(self, node_id, title, level, header, parent):
+        self.id = node_id
+        self.title = title
+        self.level = level
+        self.header = header  # Full comma-joined path, as stored in older outputs
+        self.parent = parent
+        self.children = []
+
+    def path(self):
+        """
+        Returns the nodes from the top-level ancestor down to this node.
+        """
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        return nodes[::-1]
+
+class HeaderTree:
+    """
+    The TOC as a tree of interned nodes. Chunks refer to sections by node id; header paths are
+    rendered from the tree instead of being stored and re-split on commas.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.roots = []
+        self._ids_by_header = {}
+        self._rendered = {}  # Memoized render_sections output per id tuple
+
+    def _add(self, title, level, header, parent):
+        node = HeaderNode(len(self.nodes), title, level, header, parent)
+        self.nodes.append(node)
+        (parent.children if parent else self.roots).append(node)
+        self._ids_by_header.setdefault(header, node.id)
+        return node
+
+    @classmethod
+    def from_toc(cls, toc):
+        """
+        Builds the tree from get_toc() entries ({"level", "title", "page"}), as in toc_list.generate_toc_list.
+        """
+        tree = cls()
+        stack = []  # Current ancestors
+        for entry in toc:
+            while stack and stack[-1].level >= entry["level"]:
+                stack.pop()
+            parent = stack[-1] if stack else None
+            header = f"{parent.header}, {entry['title']}" if parent else entry["title"]
+            stack.append(tree._add(entry["title"], entry["level"], header, parent))
+        return tree
+
+    @classmethod
+    def from_headers(cls, headers):
+        """
+        Builds the tree from header entries or plain header path strings in TOC order.
+        Entries with "level"/"title" (toc_builder output) are used as is; for older files the
+        parent is the closest preceding header whose path prefixes this one.
+        """
+        tree = cls()
+        stack = []
+        for entry in headers:
+            if isinstance(entry, str):
+                entry = {"header": entry}
+            header = entry["header"]
+            if "level" in entry:
+                while stack and stack[-1].level >= entry["level"]:
+                    stack.pop()
+            else:
+                while stack and not header.startswith(stack[-1].header + ", "):
+                    stack.pop()
+            parent = stack[-1] if stack else None
+            title = entry.get("title") or (header[len(parent.header) + 2:] if parent else header)
+            level = entry.get("level") or len(stack) + 1
+            stack.append(tree._add(title, level, header, parent))
+        return tree
+
+    @classmethod
+    def from_file(cls, header_file):
+        """
+        Loads a TOC header JSON file (with pages or page ranges) or a one-header-per-line text file.
+        """
+        with open(header_file, "r", encoding="utf-8") as f:
+            if header_file.endswith(".json"):
+                return cls.from_headers(json.load(f))
+            return cls.from_headers([line.strip() for line in f if line.strip()])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def header(self, node_id):
+        return self.nodes[node_id].header
+
+    def ids_for(self, headers):
+        """
+        Maps header path strings (e.g. an older output's "sections") to node ids, skipping unknown ones.
+        A path listed twice in the TOC maps to its first entry.
+        """
+        return [self._ids_by_header[header] for header in headers if header in self._ids_by_header]
+
+    def section_ids(self, metadata):
+        """
+        Returns a chunk's "section_ids" if each one names the matching "sections" path in this tree,
+        else maps the paths onto the tree. Ids recorded against a different TOC file are not trusted.
+        """
+        section_ids, sections = metadata.get("section_ids"), metadata.get("sections", [])
+        if section_ids is not None and len(section_ids) == len(sections) and all(
+                type(node_id) is int and 0 <= node_id < len(self.nodes) and self.nodes[node_id].header == header
+                for node_id, header in zip(section_ids, sections)):
+            return section_ids
+        return self.ids_for(sections)
+
+    def render_sections(self, section_ids):
+        """
+        Formats a chunk's sections as a hierarchy. Sections are grouped by their top two levels;
+        each group prints its deepest shared ancestor path, then the remaining path to each section.
+        """
+        key = tuple(section_ids)
+        if key not in self._rendered:
+            self._rendered[key] = self._render(key)
+        return self._rendered[key]
+
+    def _render(self, section_ids):
+        groups = {}
+        for node_id in section_ids:
+            path = self.nodes[node_id].path()
+            groups.setdefault(tuple(node.id for node in path[:2]), []).append(path)
+
+        formatted_output = []
+        for paths in groups.values():
+            # Walk down while every path in the group shares the same node
+            common = 0
+            while all(len(path) > common for path in paths) and len({path[common].id for path in paths}) == 1:
+                common += 1
+
+            formatted_output.append(" > ".join(node.title for node in paths[0][:common]))
+            suffixes = {" > ".join(node.title for node in path[common:]) for path in paths if len(path) > common}
+            for suffix in sorted(suffixes):
+                formatted_output.append(f"- {suffix}")
+
+        return "\n".join(formatted_output)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+
+from header_index import HeaderIndex, load_page_ranges, page_runs
+
+def candidate_fingerprint(headers):
+    """
+    Short hash of a chunk's candidate header names. It changes whenever a TOC edit changes
+    which headers cover the chunk's page, which is exactly when its classification may change.
+    """
+    return hashlib.sha256("\n".join(header["header"] for header in headers).encode("utf-8")).hexdigest()[:16]
+
+def load_previous_output(output_file):
+    with open(output_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def affected_pages(old_headers, new_headers):
+    """
+    Returns the (start, end) page runs whose covering headers differ between two TOCs.
+    """
+    old_index, new_index = HeaderIndex(old_headers), HeaderIndex(new_headers)
+    last_page = max((header["end"] for header in old_headers + new_headers if "end" in header), default=0)
+    changed = [
+        page for page in range(1, last_page + 1)
+        if [h["header"] for h in old_index.covering(page)] != [h["header"] for h in new_index.covering(page)]
+    ]
+    return page_runs(changed)
+
+class PriorResults:
+    """
+    A previous run's output indexed by chunk id and a context key (the candidate fingerprint for
+    classification, the section list for summaries). A chunk is carried forward only when both
+    its content hash and its context are unchanged; everything else is new or affected.
+    """
+
+    def __init__(self, chunks, context_key):
+        self.by_key = {}
+        for chunk in chunks:
+            key = context_key(chunk)
+            if key is not None and "id" in chunk:
+                self.by_key.setdefault((chunk["id"], key), chunk)
+        self.carried = 0
+        self.missed = 0
+
+    def get(self, chunk_id, key):
+        """
+        Returns the previous output chunk for this id and context, or None.
+        """
+        prior = self.by_key.get((chunk_id, key))
+        if prior is None:
+            self.missed += 1
+        else:
+            self.carried += 1
+        return prior
+
+    def report(self):
+        total = self.carried + self.missed
+        if total:
+            print(f"♻️ Carried forward {self.carried}/{total} chunks from the previous output; "
+                  f"{self.missed} new or affected")
+
+def prior_classifications(previous_output, previous_header_file=None, new_headers=None):
+    """
+    Loads a previous classified output for an incremental run.
+    Outputs written before fingerprints were stored need the TOC they were classified with
+    (previous_header_file) so their fingerprints can be recomputed; otherwise they are not reused.
+    """
+    old_index = None
+    if previous_header_file:
+        old_headers = load_page_ranges(previous_header_file)
+        old_index = HeaderIndex(old_headers)
+        if new_headers is not None:
+            runs = affected_pages(old_headers, new_headers)
+            pages = sum(end - start + 1 for start, end in runs)
+            print(f"📑 TOC changes affect {pages} pages in {len(runs)} ranges")
+
+    def context_key(chunk):
+        metadata = chunk.get("metadata", {})
+        if "sections" not in metadata:
+            return None
+        if metadata.get("candidate_fingerprint"):
+            return metadata["candidate_fingerprint"]
+        if old_index is not None:
+            return candidate_fingerprint(old_index.covering(metadata["page_number"]))
+        return None
+
+    return PriorResults(load_previous_output(previous_output), context_key)
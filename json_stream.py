@@ -0,0 +1,100 @@
+import json
+import os
+
+from metrics import metrics
+
+READ_SIZE = 1 << 16
+
+def iter_json_array(path, read_size=READ_SIZE):
+    """
+    Yields the items of a top-level JSON array one at a time, reading the file in blocks,
+    so memory is bounded by the largest item rather than the file.
+    """
+    decoder = json.JSONDecoder()
+    metrics.record_file(path, "read")
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        while not buffer:
+            block = f.read(read_size)
+            if not block:
+                break
+            buffer = block.lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} does not contain a JSON array")
+        buffer = buffer[1:]
+        eof = False
+
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            while not buffer and not eof:
+                block = f.read(read_size)
+                eof = not block
+                buffer = block.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                return
+            if not buffer:
+                raise ValueError(f"{path}: unexpected end of JSON array")
+            try:
+                item, end = decoder.raw_decode(buffer)
+                # A number cut at the buffer edge (e.g. "2." of "2.5") decodes early, so the item
+                # only counts as complete once a delimiter follows it
+                complete = eof or (end < len(buffer) and buffer[end] in " \t\r\n,]")
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # The item continues past the buffer; read more and try again
+                block = f.read(read_size)
+                eof = not block
+                buffer += block
+                continue
+            yield item
+            buffer = buffer[end:]
+
+class JsonArrayWriter:
+    """
+    Writes items into a JSON array file one at a time, formatted like json.dump(items, f, indent=indent).
+    Used as a context manager: the file is written under a temporary name and replaces output_file
+    only when the block exits cleanly, so an interrupted write never leaves a truncated output.
+    """
+
+    def __init__(self, output_file, indent=4, ensure_ascii=False):
+        self.output_file = output_file
+        self.tmp_path = output_file + ".tmp"
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        self.pad = " " * indent
+        self.count = 0
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.tmp_path, "w", encoding="utf-8")
+        self.f.write("[")
+        return self
+
+    def write(self, item):
+        record = json.dumps(item, indent=self.indent, ensure_ascii=self.ensure_ascii).replace("\n", "\n" + self.pad)
+        self.f.write(("," if self.count else "") + "\n" + self.pad + record)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.f.close()
+            os.remove(self.tmp_path)
+            return False
+        self.f.write("\n]" if self.count else "]")
+        self.f.close()
+        os.replace(self.tmp_path, self.output_file)
+        metrics.record_file(self.output_file, "written")
+        return False
+
+def write_json_array(items, output_file, indent=4, ensure_ascii=False):
+    """
+    Streams items into a JSON array file formatted like json.dump(items, f, indent=indent), replacing
+    the file atomically once complete. Returns the number of items written.
+    """
+    with JsonArrayWriter(output_file, indent, ensure_ascii) as writer:
+        for item in items:
+            writer.write(item)
+    return writer.count
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+
+from header_tree import HeaderTree
+from json_stream import iter_json_array, write_json_array
+
+DEFAULT_LABELS_FILE = "catalog_labels.jsonl"
+
+def label_record(chunk, summary=None):
+    """
+    Builds the sidecar label for a classified chunk: its position in catalog.json, id and sections,
+    plus the section summary if there is one. The chunk text is not copied.
+    """
+    metadata = chunk.get("metadata", {})
+    record = {
+        "index": metadata["chunk_number"] - 1,
+        "id": chunk["id"],
+        "sections": metadata.get("sections", []),
+    }
+    if "section_ids" in metadata:
+        record["section_ids"] = metadata["section_ids"]
+    if summary:
+        record["summary"] = summary
+    return record
+
+def write_labels(labels_file, records):
+    """
+    Writes label records as JSONL in chunk order, replacing the file atomically. Returns the count.
+    """
+    tmp_path = labels_file + ".tmp"
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, labels_file)
+    print(f"🏷️ Wrote {count} chunk labels to {labels_file}")
+    return count
+
+def iter_labels(labels_file):
+    with open(labels_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def labels_from_classified(classified_file, labels_file):
+    """
+    Extracts a label sidecar from a classified output without loading the whole file.
+    """
+    return write_labels(labels_file, (label_record(chunk) for chunk in iter_json_array(classified_file)))
+
+def compose_header(label, style="summary", tree=None):
+    """
+    Renders the text prepended to a chunk: the GPT summary ("summary", as add_english_headers
+    writes it) or the section hierarchy ("sections", as add_headers writes it).
+    """
+    if style == "summary":
+        return label.get("summary")
+    section_ids = tree.section_ids(label)
+    return tree.render_sections(section_ids) if section_ids else None
+
+def iter_labeled_chunks(catalog_file, labels_file, style="summary", header_file=None):
+    """
+    Streams catalog.json and the label sidecar side by side, yielding each labeled chunk with its
+    header composed onto the text on demand. Chunks without a label are skipped, as they are
+    missing from the materialized outputs. Both files are read incrementally.
+    """
+    tree = HeaderTree.from_file(header_file) if style == "sections" else None
+    labels = iter_labels(labels_file)
+    label = next(labels, None)
+
+    for index, chunk in enumerate(iter_json_array(catalog_file)):
+        while label is not None and label["index"] < index:
+            label = next(labels, None)
+        if label is None:
+            return
+        if label["index"] != index:
+            continue
+        if label["id"] != chunk["id"]:
+            raise ValueError(f"Label for chunk #{index + 1} belongs to a different chunk; rebuild {labels_file}")
+
+        chunk["metadata"]["sections"] = label["sections"]
+        if "section_ids" in label:
+            chunk["metadata"]["section_ids"] = label["section_ids"]
+        chunk["metadata"]["chunk_number"] = index + 1
+        header = compose_header(label, style, tree)
+        if header:
+            chunk["text"] = f"{header}\n\n{chunk['text']}"
+        yield chunk
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write chunk label sidecars and render labeled chunks from them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    extract_parser = subparsers.add_parser("extract", help="Build a label sidecar from a classified output")
+    extract_parser.add_argument("classified_file", nargs="?", default="classified_catalog_agent_new.json")
+    extract_parser.add_argument("labels_file", nargs="?", default=DEFAULT_LABELS_FILE)
+    render_parser = subparsers.add_parser("render", help="Write catalog chunks with their headers composed in")
+    render_parser.add_argument("output_file")
+    render_parser.add_argument("--catalog", default="catalog.json")
+    render_parser.add_argument("--labels", default=DEFAULT_LABELS_FILE)
+    render_parser.add_argument("--style", choices=["summary", "sections"], default="summary")
+    render_parser.add_argument("--headers", default="toc_headers_with_page_ranges.json",
+                               help="TOC used to render the sections style")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        labels_from_classified(args.classified_file, args.labels_file)
+    else:
+        chunks = iter_labeled_chunks(args.catalog, args.labels, args.style, args.headers)
+        count = write_json_array(chunks, args.output_file, indent=2)
+        print(f"Processed {count} chunks and wrote output to {args.output_file}")
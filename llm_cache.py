@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+DEFAULT_CACHE_FILE = "llm_cache.sqlite"
+
+# Run an eviction pass after this many new entries rather than on every write
+EVICT_EVERY = 200
+
+class LLMCache:
+    """
+    Persistent cache of chat completion replies, stored in a local SQLite file.
+    Entries are keyed by model, temperature and a hash of the exact messages, and are evicted
+    once they are older than max_age_days or the cache grows past max_entries / max_bytes
+    (least recently used first). Only replies that passed validation should be stored.
+    The file is opened on the first lookup or store, so importing a script that owns a cache
+    doesn't create one.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, max_entries=100_000, max_bytes=256 * 1024 * 1024, max_age_days=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        """
+        Returns the SQLite connection, opening the file and evicting stale entries on first use.
+        Call with self._lock held.
+        """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY,"
+                    " model TEXT NOT NULL,"
+                    " content TEXT NOT NULL,"
+                    " size INTEGER NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " last_used_at REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used_at)")
+            self._evict()
+        return self._conn
+
+    @staticmethod
+    def make_key(model, temperature, messages, **params):
+        payload = json.dumps(
+            {"model": model, "temperature": temperature, "messages": messages, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model, temperature, messages, **params):
+        """
+        Returns the cached reply for this exact request, or None on a miss.
+        """
+        key = self.make_key(model, temperature, messages, **params)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT content, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                metrics.inc("llm_cache_lookups_total", result="miss")
+                return None
+            with conn:
+                conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            metrics.inc("llm_cache_lookups_total", result="hit")
+            return row[0]
+
+    def put(self, model, temperature, messages, content, **params):
+        """
+        Stores a validated reply for this exact request.
+        """
+        key = self.make_key(model, temperature, messages, **params)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, content, size, created_at, last_used_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, content, len(content.encode("utf-8")), now, now),
+                )
+            self._puts_since_evict += 1
+            evict_now = self._puts_since_evict >= EVICT_EVERY
+        if evict_now:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used ones beyond the entry and size limits.
+        """
+        with self._lock:
+            self._connection()
+            self._evict()
+
+    def _evict(self):
+        with self._conn:
+            self._puts_since_evict = 0
+            self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size <= self.max_bytes:
+                return
+            stale_keys = []
+            for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used_at"):
+                if total_size <= self.max_bytes:
+                    break
+                stale_keys.append((key,))
+                total_size -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+    def stats(self):
+        with self._lock:
+            if self._conn is None and not os.path.exists(self.path):
+                entries = 0
+            else:
+                entries = self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(
+            f"🗄️ LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries stored"
+        )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
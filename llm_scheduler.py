@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import openai
+
+from metrics import metrics
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+class InvalidResponse(Exception):
+    """
+    Raised by a response validator when the model's reply can't be used; counts as a retry.
+    """
+
+class RetryBudgetExhausted(Exception):
+    """
+    Raised when a request has failed max_retries + 1 times. The request is also dead-lettered.
+    """
+
+    def __init__(self, key, attempts, last_error):
+        super().__init__(f"{key}: gave up after {attempts} attempts ({last_error!r})")
+        self.key = key
+        self.attempts = attempts
+        self.last_error = last_error
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute.
+    reserve() takes the tokens immediately and returns how long the caller must wait before
+    using them, so the same bucket works for blocking and asyncio callers.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+def retry_after_seconds(error):
+    """
+    Reads the server's Retry-After hint from an API error, if it sent one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def estimate_tokens(messages, completion_tokens=0):
+    """
+    Rough token count for rate limiting: about four characters per token plus per-message overhead.
+    """
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 4 + 4 * len(messages) + completion_tokens
+
+class RequestScheduler:
+    """
+    Shared front door for every LLM call: enforces requests-per-minute and tokens-per-minute
+    budgets, retries transient failures and invalid replies with jittered exponential backoff
+    (honoring Retry-After), and dead-letters requests that exhaust their retry budget.
+    """
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=30_000, max_retries=5,
+                 base_delay=1.0, max_delay=60.0):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.retries = 0
+        self.retry_reasons = Counter()  # Error type name -> retries it caused
+        self.dead_letters = []
+        self._lock = threading.Lock()
+
+    def _admission_delay(self, tokens):
+        delay = max(self.request_bucket.reserve(1), self.token_bucket.reserve(tokens))
+        if delay > 0:
+            metrics.observe("llm_throttle_seconds", delay)
+        return delay
+
+    def _backoff_delay(self, attempt, error):
+        hinted = retry_after_seconds(error)
+        if hinted is not None:
+            return hinted
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _settle_tokens(self, response, estimated):
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None):
+            self.token_bucket.refund(estimated - usage.total_tokens)
+
+    def _record_retry(self, key, attempt, error, delay):
+        with self._lock:
+            self.retries += 1
+            self.retry_reasons[type(error).__name__] += 1
+        metrics.inc("llm_retries_total", reason=type(error).__name__)
+        metrics.observe("llm_backoff_seconds", delay, reason=type(error).__name__)
+        print(f"⚠️ {type(error).__name__} for {key}: retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+
+    def _give_up(self, key, attempts, error, dead_letter):
+        if dead_letter:
+            with self._lock:
+                self.dead_letters.append({"key": key, "attempts": attempts, "error": repr(error)})
+            metrics.inc("llm_dead_letters_total")
+        print(f"☠️ Giving up on {key} after {attempts} attempts: {error!r}")
+        return RetryBudgetExhausted(key, attempts, error)
+
+    def call(self, request, messages, key=None, validate=None, completion_tokens=50, dead_letter=True):
+        """
+        Runs request() under the rate limits and returns validate(response) (or the response).
+        Pass dead_letter=False when the caller has a fallback for a request that gives up.
+        """
+        estimated = estimate_tokens(messages, completion_tokens)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self._admission_delay(estimated))
+            with self._lock:
+                self.calls += 1
+            metrics.inc("llm_requests_total")
+            try:
+                start = time.perf_counter()
+                response = request()
+                metrics.record_response(response, time.perf_counter() - start)
+                self._settle_tokens(response, estimated)
+                return validate(response) if validate else response
+            except RETRYABLE_ERRORS + (InvalidResponse,) as error:
+                if attempt == self.max_retries:
+                    raise self._give_up(key, attempt + 1, error, dead_letter)
+                delay = self._backoff_delay(attempt, error)
+                self._record_retry(key, attempt, error, delay)
+                time.sleep(delay)
+
+    async def call_async(self, request, messages, key=None, validate=None, completion_tokens=50, dead_letter=True):
+        """
+        Async counterpart of call(); request is a coroutine function.
+        """
+        estimated = estimate_tokens(messages, completion_tokens)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self._admission_delay(estimated))
+            with self._lock:
+                self.calls += 1
+            metrics.inc("llm_requests_total")
+            try:
+                start = time.perf_counter()
+                response = await request()
+                metrics.record_response(response, time.perf_counter() - start)
+                self._settle_tokens(response, estimated)
+                return validate(response) if validate else response
+            except RETRYABLE_ERRORS + (InvalidResponse,) as error:
+                if attempt == self.max_retries:
+                    raise self._give_up(key, attempt + 1, error, dead_letter)
+                delay = self._backoff_delay(attempt, error)
+                self._record_retry(key, attempt, error, delay)
+                await asyncio.sleep(delay)
+
+    def write_dead_letters(self, path):
+        """
+        Saves the requests that exhausted their retries in this run. When there are none, a file
+        left by an earlier run is removed, since the rerun has retried those requests.
+        """
+        if not self.dead_letters:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.dead_letters, f, indent=4)
+        print(f"☠️ {len(self.dead_letters)} requests exhausted their retries; listed in {path}")
+
+    def discard_dead_letters(self, key):
+        """
+        Drops the dead letters recorded for key, once the caller's own retry of it succeeded.
+        """
+        with self._lock:
+            self.dead_letters = [letter for letter in self.dead_letters if letter["key"] != key]
+
+    def report(self):
+        reasons = ", ".join(f"{name}: {count}" for name, count in self.retry_reasons.most_common())
+        print(f"📡 LLM requests: {self.calls} sent, {self.retries} retries{f' ({reasons})' if reasons else ''}, "
+              f"{len(self.dead_letters)} dead-lettered")
+
+def dead_letter_path(output_file):
+    """
+    Returns the dead-letter file written next to an output file.
+    """
+    return os.path.splitext(output_file)[0] + ".dead_letters.json"
@@ -0,0 +1,182 @@
+import atexit
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+# Set CATALOG_METRICS to a file path to collect metrics for a run of any pipeline script. The JSON
+# snapshot is written there at exit, with the Prometheus text format next to it (.prom).
+# Set CATALOG_PROFILE to a directory to also write a cProfile dump per stage.
+METRICS_ENV = "CATALOG_METRICS"
+PROFILE_ENV = "CATALOG_PROFILE"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """
+    In-process counters and timers, keyed by name and labels. Every recording method returns
+    immediately while the registry is disabled, so the hooks cost almost nothing by default.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_dir = None
+        self._profiling = False
+        self.counters = {}  # (name, labels) -> value
+        self.timers = {}  # (name, labels) -> [count, total seconds, max seconds]
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def enable(self, profile_dir=None):
+        self.enabled = True
+        self.profile_dir = profile_dir
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def stage(self, name):
+        """
+        Context manager timing a pipeline stage, and profiling it when a profile directory is set.
+        Stage times include any stages nested inside them.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        # Only one cProfile can be active at a time, so a nested stage is profiled as part of its parent
+        profiler = None
+        if self.profile_dir and not self._profiling:
+            profiler = cProfile.Profile()
+            self._profiling = True
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                self._profiling = False
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.{os.getpid()}.prof"))
+            self.observe("stage_seconds", time.perf_counter() - start, stage=name)
+
+    def record_response(self, response, seconds):
+        """
+        Records one API call: its latency and the prompt/completion tokens from response.usage.
+        """
+        if not self.enabled:
+            return
+        model = getattr(response, "model", None) or "unknown"
+        self.observe("llm_request_seconds", seconds, model=model)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.inc("llm_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+            self.inc("llm_tokens_total", getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+    def record_file(self, path, direction):
+        """
+        Adds a file's size to the bytes read or written ("read" / "written").
+        """
+        if not self.enabled:
+            return
+        with contextlib.suppress(OSError):
+            self.inc("file_bytes_total", os.path.getsize(path), direction=direction)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "timers": [
+                    {"name": name, "labels": dict(labels), "count": count, "total_seconds": round(total, 6),
+                     "max_seconds": round(longest, 6)}
+                    for (name, labels), (count, total, longest) in sorted(self.timers.items())
+                ],
+            }
+
+    def prometheus_text(self):
+        """
+        Renders the snapshot in the Prometheus text exposition format (for the node exporter's
+        textfile collector). Timers become summaries with _count and _sum series, and their
+        longest duration a separate _max gauge family, since _max is not a summary sample.
+        """
+        def series(name, labels, value):
+            label_text = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+            return f"catalog_{name}{{{label_text}}} {value}" if label_text else f"catalog_{name} {value}"
+
+        snapshot = self.snapshot()
+        lines, typed = [], set()
+        for counter in snapshot["counters"]:
+            if counter["name"] not in typed:
+                lines.append(f"# TYPE catalog_{counter['name']} counter")
+                typed.add(counter["name"])
+            lines.append(series(counter["name"], counter["labels"], counter["value"]))
+        timers = {}
+        for timer in snapshot["timers"]:
+            timers.setdefault(timer["name"], []).append(timer)
+        for name, family in timers.items():
+            # Each family's samples stay contiguous under its own TYPE line
+            lines.append(f"# TYPE catalog_{name} summary")
+            for timer in family:
+                lines.append(series(name + "_count", timer["labels"], timer["count"]))
+                lines.append(series(name + "_sum", timer["labels"], timer["total_seconds"]))
+            lines.append(f"# TYPE catalog_{name}_max gauge")
+            lines.extend(series(name + "_max", timer["labels"], timer["max_seconds"]) for timer in family)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the JSON snapshot to path and the Prometheus text next to it, each replaced atomically.
+        """
+        prom_path = os.path.splitext(path)[0] + ".prom"
+        for target, content in ((path, json.dumps(self.snapshot(), indent=4)), (prom_path, self.prometheus_text())):
+            with open(target + ".tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(target + ".tmp", target)
+        print(f"📈 Metrics saved to {path} and {prom_path}")
+
+    def report(self):
+        snapshot = self.snapshot()
+        print(f"\n📈 Run summary ({snapshot['elapsed_seconds']:.1f}s)")
+        for timer in snapshot["timers"]:
+            labels = ", ".join(f"{key}={value}" for key, value in timer["labels"].items())
+            print(f"   ⏱️ {timer['name']} [{labels}]: {timer['count']} × avg "
+                  f"{timer['total_seconds'] / timer['count'] * 1000:.1f} ms, total {timer['total_seconds']:.2f}s")
+        for counter in snapshot["counters"]:
+            labels = ", ".join(f"{key}={value}" for key, value in counter["labels"].items())
+            print(f"   🔢 {counter['name']} [{labels}]: {counter['value']}")
+
+metrics = Metrics()
+
+def _export_at_exit(path):
+    metrics.report()
+    metrics.write(path)
+
+if os.environ.get(METRICS_ENV):
+    metrics.enable(os.environ.get(PROFILE_ENV))
+    atexit.register(_export_at_exit, os.environ[METRICS_ENV])
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import zlib
+
+import numpy as np
+
+from header_retrieval import tokenize
+from metrics import metrics
+from page_markers import annotate_page_spans, prompt_text
+
+SHINGLE_SIZE = 5  # Words per shingle
+NUM_PERMUTATIONS = 128
+BANDS = 32  # 4 signature rows per LSH band; pairs at 0.9 similarity share a band with near certainty
+NEAR_DUPLICATE_THRESHOLD = 0.9  # Minimum estimated Jaccard similarity to reuse a classification
+PRIME = (1 << 31) - 1  # Hash values are reduced mod this prime, so a * h + b fits in int64
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """
+    Returns the sorted unique CRC32 hashes of the text's word shingles. Tokenizing first makes
+    line breaks, punctuation and case irrelevant. A text shorter than one shingle is a single shingle.
+    """
+    tokens = tokenize(text)
+    shingles = [" ".join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))] if tokens else []
+    return np.unique(np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.int64,
+                                 count=len(shingles)))
+
+class MinHasher:
+    """
+    num_permutations universal hash functions (a * h + b) mod PRIME with fixed seeds, so
+    signatures are comparable across runs.
+    """
+
+    def __init__(self, num_permutations=NUM_PERMUTATIONS, seed=0):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, num_permutations, dtype=np.int64)
+        self.b = rng.integers(0, PRIME, num_permutations, dtype=np.int64)
+
+    def signature(self, hashes):
+        return ((np.outer(hashes % PRIME, self.a) + self.b) % PRIME).min(axis=0).astype(np.uint32)
+
+def near_duplicate_log_path(output_file):
+    """
+    Returns the audit log of reused classifications written next to an output file.
+    """
+    return os.path.splitext(output_file)[0] + ".near_duplicates.jsonl"
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of every chunk's shingles, bucketed by LSH band, built in one pass over the
+    catalog. Classified chunks register their sections with add(). A later chunk reuses the
+    sections of its most similar classified chunk when their estimated Jaccard similarity reaches
+    the threshold and all of those sections are among its own candidate headers. Each reuse is
+    appended to the audit log.
+    """
+
+    def __init__(self, chunks, threshold=NEAR_DUPLICATE_THRESHOLD, audit_file=None, bands=BANDS, hasher=None):
+        self.threshold = threshold
+        self.audit_file = audit_file
+        self.hasher = hasher or MinHasher()
+        self.bands = bands
+        self.band_rows = len(self.hasher.a) // bands
+        self.rows = {}  # chunk id -> signature row; identical texts share a row
+        self.buckets = [{} for _ in range(bands)]  # band key -> rows
+        signatures = []
+        for chunk in chunks:
+            if chunk["id"] in self.rows:
+                continue
+            hashes = shingle_hashes(prompt_text(chunk))
+            if not len(hashes):
+                continue  # Nothing to compare; empty chunks never match each other
+            row = len(signatures)
+            self.rows[chunk["id"]] = row
+            signatures.append(self.hasher.signature(hashes))
+            for band, key in enumerate(self._band_keys(signatures[-1])):
+                self.buckets[band].setdefault(key, []).append(row)
+        self.signatures = np.vstack(signatures) if signatures else np.zeros((0, len(self.hasher.a)), np.uint32)
+        self.answers = {}  # row -> {"chunk_number", "id", "sections"} of the first chunk classified
+        self.reused = 0
+        self.missed = 0
+
+    def _band_keys(self, signature):
+        return [signature[band * self.band_rows:(band + 1) * self.band_rows].tobytes() for band in range(self.bands)]
+
+    def add(self, chunk):
+        """
+        Registers a classified chunk's sections for reuse. 'Unclassified' is never reused.
+        """
+        row = self.rows.get(chunk["id"])
+        sections = chunk["metadata"].get("sections")
+        if row is None or not sections or sections == ["Unclassified"] or row in self.answers:
+            return
+        self.answers[row] = {"chunk_number": chunk["metadata"].get("chunk_number"), "id": chunk["id"],
+                             "sections": list(sections)}
+
+    def similar(self, chunk):
+        """
+        Returns (similarity, answer) for the classified chunks sharing an LSH band with this
+        one, most similar first.
+        """
+        row = self.rows.get(chunk["id"])
+        if row is None:
+            return []
+        others = {other for band, key in enumerate(self._band_keys(self.signatures[row]))
+                  for other in self.buckets[band].get(key, ()) if other in self.answers}
+        if not others:
+            return []
+        others = sorted(others)
+        similarities = (self.signatures[others] == self.signatures[row]).mean(axis=1)
+        return sorted(((float(s), self.answers[other]) for s, other in zip(similarities, others)),
+                      key=lambda match: -match[0])
+
+    def reuse(self, chunk, candidates, chunk_number=None):
+        """
+        Returns the sections of a near-duplicate classified chunk if this chunk can take them
+        over, else None. chunk_number is the chunk's position in the output, for the audit log.
+        """
+        names = {header["header"] for header in candidates}
+        for similarity, answer in self.similar(chunk):
+            if similarity < self.threshold:
+                break
+            if set(answer["sections"]) <= names:
+                self.reused += 1
+                metrics.inc("near_duplicate_lookups_total", result="reused")
+                self._audit(chunk, chunk_number, similarity, answer)
+                return list(answer["sections"])
+        self.missed += 1
+        metrics.inc("near_duplicate_lookups_total", result="missed")
+        return None
+
+    def _audit(self, chunk, chunk_number, similarity, answer):
+        if not self.audit_file:
+            return
+        record = {
+            "chunk_number": chunk_number,
+            "id": chunk["id"],
+            "source_chunk_number": answer["chunk_number"],
+            "source_id": answer["id"],
+            "similarity": round(similarity, 4),
+            "sections": answer["sections"],
+        }
+        with open(self.audit_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def report(self):
+        total = self.reused + self.missed
+        if total:
+            log = f"; audit log in {self.audit_file}" if self.audit_file and self.reused else ""
+            print(f"🧬 Reused {self.reused}/{total} classifications from near-duplicate chunks "
+                  f"(similarity ≥ {self.threshold:.2f}){log}")
+
+def near_duplicate_groups(index):
+    """
+    Groups chunk ids whose signatures reach the index threshold with some other member of the
+    group (single-link). Returns the groups of two or more, largest first.
+    """
+    ids = list(index.rows)
+    parent = list(range(len(ids)))
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for bucket in index.buckets:
+        for rows in bucket.values():
+            for other in rows[1:]:
+                if (index.signatures[rows[0]] == index.signatures[other]).mean() >= index.threshold:
+                    parent[find(other)] = find(rows[0])
+    groups = {}
+    for row, chunk_id in enumerate(ids):
+        groups.setdefault(find(row), []).append(chunk_id)
+    return sorted((group for group in groups.values() if len(group) > 1), key=len, reverse=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report near-duplicate chunks in the catalog (MinHash/LSH).")
+    parser.add_argument("chunk_file", nargs="?", default="catalog.json")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD)
+    args = parser.parse_args()
+
+    with open(args.chunk_file, "r", encoding="utf-8") as f:
+        chunks = annotate_page_spans(json.load(f))
+    index = NearDuplicateIndex(chunks, args.threshold)
+    groups = near_duplicate_groups(index)
+    first_number = {}
+    for number, chunk in enumerate(chunks, start=1):
+        first_number.setdefault(chunk["id"], number)
+    duplicates = sum(len(group) - 1 for group in groups)
+    print(f"🧬 {len(groups)} groups of near-duplicate chunks; up to {duplicates} of {len(chunks)} chunks "
+          f"could reuse another chunk's classification")
+    for group in groups[:10]:
+        print(f"   chunks {', '.join(str(first_number[chunk_id]) for chunk_id in group[:12])}"
+              f"{' …' if len(group) > 12 else ''}")
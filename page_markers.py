@@ -0,0 +1,97 @@
+import argparse
+import json
+import re
+
+from json_stream import write_json_array
+
+# Running footer printed at the end of every catalog page, e.g. "Page 17 of 1019". PDF extraction
+# sometimes glues the next page's first line onto it ("Page 17 of 1019 Calendar 2024/2025"), so
+# only the marker itself is matched, not the whole line.
+PAGE_MARKER = re.compile(r"^Page (\d+) of \d+", re.MULTILINE)
+
+def page_spans(text, page):
+    """
+    Splits a chunk's text at its page markers. A marker closes its page, so text before it is on
+    that page and text after the last marker is on the next one. page is where the chunk starts
+    if it has no marker before its first text. Returns (splits, markers, next_page): the
+    [page, offset] where each page's text starts, the [start, end] of each marker, and the page
+    the following chunk starts on.
+    """
+    splits, markers = [], []
+    position = 0
+    for match in PAGE_MARKER.finditer(text):
+        marker_page, start, end = int(match.group(1)), match.start(), match.end()
+        if text[position:start].strip():
+            splits.append([marker_page, position])
+        markers.append([start, end])
+        position = end
+        page = marker_page + 1
+    if text[position:].strip():
+        splits.append([page, position])
+    return splits, markers, page
+
+def iter_page_spans(chunks):
+    """
+    Adds each chunk's exact page span to its metadata, in catalog order, yielding the chunks as it
+    goes: "page_span" is [first_page, last_page], and chunks with markers also get "page_splits"
+    and "page_markers" (character offsets into the text). The marker just before a chunk decides
+    its first page, so a stale page_number tag is corrected.
+    """
+    next_page = None
+    for chunk in chunks:
+        metadata = chunk["metadata"]
+        page = metadata["page_number"] if next_page is None else max(metadata["page_number"], next_page)
+        splits, markers, next_page = page_spans(chunk["text"], page)
+        metadata["page_span"] = [splits[0][0], splits[-1][0]] if splits else [page, page]
+        if markers:
+            metadata["page_splits"] = splits
+            metadata["page_markers"] = markers
+        yield chunk
+
+def annotate_page_spans(chunks):
+    """
+    Annotates a list of chunks with iter_page_spans. Returns the chunks.
+    """
+    for _ in iter_page_spans(chunks):
+        pass
+    return chunks
+
+def prompt_text(chunk):
+    """
+    Returns the chunk text without its page markers. A marker line is dropped; text glued after
+    a marker keeps its own line.
+    """
+    text = chunk["text"]
+    markers = chunk["metadata"].get("page_markers")
+    if not markers:
+        return text
+    pieces, position = [], 0
+    for start, end in markers:
+        pieces.append(text[position:start])
+        while end < len(text) and text[end] in " \t":
+            end += 1
+        if end < len(text) and text[end] == "\n" and (start == 0 or text[start - 1] == "\n"):
+            end += 1
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces).strip("\n")
+
+def report_page_spans(chunks):
+    multi_page = sum(1 for chunk in chunks if chunk["metadata"]["page_span"][0] != chunk["metadata"]["page_span"][1])
+    retagged = sum(1 for chunk in chunks if chunk["metadata"]["page_span"][0] != chunk["metadata"]["page_number"])
+    stripped = sum(len(chunk["text"]) - len(prompt_text(chunk)) for chunk in chunks)
+    print(f"📄 {multi_page} of {len(chunks)} chunks span more than one page; {retagged} start on a different "
+          f"page than tagged; {stripped} characters of page markers stripped from prompts")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute each chunk's page span from the catalog's page markers.")
+    parser.add_argument("chunk_file", nargs="?", default="catalog.json")
+    parser.add_argument("--output", help="Write the chunks with page spans added (default: only report)")
+    args = parser.parse_args()
+
+    with open(args.chunk_file, "r", encoding="utf-8") as f:
+        chunks = annotate_page_spans(json.load(f))
+    report_page_spans(chunks)
+    if args.output:
+        count = write_json_array(chunks, args.output)
+        print(f"✅ Saved {count} chunks with page spans to {args.output}")
@@ -0,0 +1,243 @@
+import argparse
+import contextlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from json_stream import JsonArrayWriter, iter_json_array
+from metrics import metrics
+from page_markers import iter_page_spans
+
+STAGES = ["toc", "classify", "headers", "summaries"]
+DEAD_LETTER_RETRIES = 1  # Extra rounds for a request that exhausted its retries before its chunk is dropped
+
+# Stages chained in one streaming pass: chunk records flow from the input file through
+# classification into every selected output, and no stage holds the whole corpus. The TOC stage
+# runs first since every other stage reads the headers it writes.
+
+def finished(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def ordered(items, max_in_flight):
+    """
+    Yields the (item, future) pairs in order, keeping up to max_in_flight * 2 items queued so slow
+    requests at the head don't leave the workers idle. Items whose future is already done pass
+    straight through.
+    """
+    pending = deque()
+    for item, future in items:
+        pending.append((item, future))
+        while len(pending) > max_in_flight * 2 or (pending and pending[0][1].done()):
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+def classify_stream(chunks, lookup, max_in_flight=8, use_cascade=False, structured=False,
+                    dead_letter_retries=DEAD_LETTER_RETRIES):
+    """
+    Classifies chunks as they stream past and yields them classified, in input order. Chunks the
+    lookup resolves locally need no request, chunks without candidate headers become
+    'Unclassified', and the rest are sent to the model up to max_in_flight at a time.
+    The pipeline keeps no journal to resume from, so a dead-lettered chunk is retried in place
+    up to dead_letter_retries more times, and only then left out of the output.
+    """
+    import classification_agent_new as agent
+
+    def classify(chunk, chunk_index, candidates):
+        try:
+            return agent.classify_with_gpt(agent.prompt_text(chunk), candidates, key=agent.chunk_key(chunk_index, chunk),
+                                           use_cascade=use_cascade, structured=structured)
+        except agent.RetryBudgetExhausted:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        def submitted():
+            for chunk_index, chunk in enumerate(chunks):
+                selected_headers = lookup.resolve_locally(chunk, chunk_index)
+                candidates = [] if selected_headers else lookup.candidates(chunk)
+                if candidates:
+                    yield (chunk_index, chunk), executor.submit(classify, chunk, chunk_index, candidates)
+                else:
+                    yield (chunk_index, chunk), finished(selected_headers or [])  # [] is recorded as Unclassified
+
+        for (chunk_index, chunk), future in ordered(submitted(), max_in_flight):
+            selected_headers = future.result()
+            for _ in range(dead_letter_retries):
+                if selected_headers is not None:
+                    break
+                print(f"🔁 Retrying dead-lettered chunk #{chunk_index + 1}")
+                agent.scheduler.discard_dead_letters(agent.chunk_key(chunk_index, chunk))  # Recorded again if it fails
+                selected_headers = classify(chunk, chunk_index, lookup.candidates(chunk))
+            if selected_headers is None:
+                continue  # Dead-lettered; left out of the output
+            agent.apply_classification(chunk, chunk_index, selected_headers, lookup)
+            yield chunk
+
+def prefetch_summaries(chunks, max_workers=8, dead_letter_retries=DEAD_LETTER_RETRIES):
+    """
+    Requests each distinct section list's summary once, in the background, as chunks stream past.
+    Yields (chunk, summary) in input order; summary is None for chunks without sections, and also
+    for chunks whose summary was still dead-lettered after dead_letter_retries more rounds.
+    """
+    import add_english_headers
+
+    def summarize(sections):
+        try:
+            return add_english_headers.generate_section_summary(list(sections))
+        except add_english_headers.RetryBudgetExhausted:
+            return None
+
+    summaries = {}  # tuple(sections) -> Future; one entry per section set, not per chunk
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submitted():
+            for chunk in chunks:
+                sections = tuple(chunk.get("metadata", {}).get("sections", []))
+                if not sections:
+                    yield chunk, finished(None)
+                    continue
+                if sections not in summaries:
+                    summaries[sections] = executor.submit(summarize, sections)
+                yield chunk, summaries[sections]
+
+        for chunk, future in ordered(submitted(), max_workers):
+            summary = future.result()
+            sections = tuple(chunk.get("metadata", {}).get("sections", []))
+            if summary is None and sections and summaries[sections] is future:
+                for _ in range(dead_letter_retries):
+                    print(f"🔁 Retrying dead-lettered summary for {'; '.join(sections)[:80]}")
+                    add_english_headers.scheduler.discard_dead_letters({"sections": list(sections)})
+                    summary = summarize(sections)
+                    if summary is not None:
+                        break
+                summaries[sections] = finished(summary)  # Later chunks with these sections reuse the outcome
+            elif sections:
+                summary = summaries[sections].result()
+            yield chunk, summary
+    print(f"🧮 {len(summaries)} unique section sets summarized")
+
+def with_text(chunk, header, **metadata):
+    """
+    Returns a copy of the chunk with header prepended to its text, leaving the chunk itself
+    untouched for the other outputs.
+    """
+    return {**chunk, "text": f"{header}\n\n{chunk['text']}", "metadata": {**chunk["metadata"], **metadata}}
+
+def run_pipeline(args):
+    """
+    Runs the selected stages. The chunk records are read with iter_json_array and every output is
+    written with a JsonArrayWriter, so only the chunks in flight are in memory.
+    """
+    stages = set(args.stages)
+    if "toc" in stages:
+        from toc_builder import build_toc
+        with metrics.stage("toc"):
+            build_toc(args.pdf, header_txt_path=args.header_list, pages_json_path=args.header_pages,
+                      ranges_json_path=args.header_file)
+
+    if not stages & {"classify", "headers", "summaries"}:
+        return
+
+    lookup = None
+    if "classify" in stages:
+        import classification_agent_new as agent
+        if args.cascade_threshold is not None:
+            agent.cascade.threshold = args.cascade_threshold
+        shortlist_k = agent.SHORTLIST_K if args.shortlist_k is None else args.shortlist_k
+        lookup = agent.load_header_lookup(args.header_file, shortlist_k=shortlist_k, use_fast_path=args.use_fast_path)
+        if args.near_duplicate_threshold:
+            # One extra streaming pass over the catalog to sign every chunk before classifying
+            with metrics.stage("index_near_duplicates"):
+                lookup.near_duplicates = agent.NearDuplicateIndex(
+                    iter_page_spans(iter_json_array(args.catalog)), args.near_duplicate_threshold,
+                    agent.near_duplicate_log_path(args.classified))
+        chunks = classify_stream(iter_page_spans(iter_json_array(args.catalog)), lookup, args.max_in_flight,
+                                 args.cascade, args.structured, args.dead_letter_retries)
+    else:
+        chunks = iter_json_array(args.classified)  # Classified by an earlier run
+
+    tree = None
+    if "headers" in stages:
+        from add_headers import section_header
+        from header_tree import HeaderTree
+        tree = HeaderTree.from_file(args.header_file)
+
+    records = ((chunk, None) for chunk in chunks)
+    if "summaries" in stages:
+        records = prefetch_summaries(chunks, args.summary_workers, args.dead_letter_retries)
+
+    try:
+        with contextlib.ExitStack() as outputs, metrics.stage("stream"):
+            # Same formatting as the standalone scripts' outputs
+            classified = outputs.enter_context(JsonArrayWriter(args.classified, indent=4, ensure_ascii=True)) \
+                if "classify" in stages else None
+            headed = outputs.enter_context(JsonArrayWriter(args.headers_output, indent=2)) if tree else None
+            summarized = outputs.enter_context(JsonArrayWriter(args.summaries_output, indent=2)) \
+                if "summaries" in stages else None
+
+            for position, (chunk, summary) in enumerate(records):
+                if classified:
+                    classified.write(chunk)
+                if headed:
+                    header = section_header(chunk, tree)
+                    headed.write(with_text(chunk, header) if header is not None else chunk)
+                if summarized:
+                    # add_english_headers.py numbers chunks by their position in the classified output
+                    if summary is not None:
+                        summarized.write(with_text(chunk, summary, chunk_number=position + 1))
+                    elif not chunk.get("metadata", {}).get("sections"):
+                        summarized.write({**chunk, "metadata": {**chunk["metadata"], "chunk_number": position + 1}})
+    finally:
+        report(stages, args, lookup)
+
+    for writer, label in ((classified, "classified"), (headed, "with section headers"),
+                          (summarized, "with summaries")):
+        if writer:
+            print(f"✅ Wrote {writer.count} chunks {label} to {writer.output_file}")
+
+def report(stages, args, lookup=None):
+    if "classify" in stages:
+        import classification_agent_new as agent
+        lookup.report()
+        if args.cascade:
+            agent.cascade.report()
+        agent.cache.report()
+        agent.scheduler.report()
+        agent.scheduler.write_dead_letters(agent.dead_letter_path(args.classified))
+    if "summaries" in stages:
+        import add_english_headers
+        add_english_headers.cache.report()
+        add_english_headers.scheduler.report()
+        add_english_headers.scheduler.write_dead_letters(add_english_headers.dead_letter_path(args.summaries_output))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the catalog pipeline (TOC, classification, section headers, summaries) in one streaming pass.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=["classify", "headers", "summaries"],
+                        help="Stages to run; later stages read the classified file when classify is not selected")
+    parser.add_argument("--pdf", default="catalog.pdf", help="Catalog PDF for the toc stage")
+    parser.add_argument("--catalog", default="catalog.json", help="Chunked catalog to classify")
+    parser.add_argument("--header-list", default="toc_headers.txt")
+    parser.add_argument("--header-pages", default="toc_headers_with_pages.json")
+    parser.add_argument("--header-file", default="toc_headers_with_page_ranges.json",
+                        help="TOC headers with page ranges, used by classify and headers")
+    parser.add_argument("--classified", default="classified_catalog_agent_new.json",
+                        help="Classified output of classify; input of headers and summaries otherwise")
+    parser.add_argument("--headers-output", default="catalog_with_headers_new.json")
+    parser.add_argument("--summaries-output", default="catalog_english_headers.json")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="Concurrent classification requests")
+    parser.add_argument("--summary-workers", type=int, default=8, help="Concurrent summary requests")
+    parser.add_argument("--shortlist-k", type=int,
+                        help="Send only the k best locally ranked candidate headers per chunk (0 sends all; "
+                             "default as in classification_agent_new.py)")
+    parser.add_argument("--no-fast-path", dest="use_fast_path", action="store_false")
+    parser.add_argument("--cascade", action="store_true")
+    parser.add_argument("--cascade-threshold", type=float)
+    parser.add_argument("--structured", action="store_true")
+    parser.add_argument("--dead-letter-retries", type=int, default=DEAD_LETTER_RETRIES,
+                        help="Extra rounds for a request that exhausted its retries before its chunk is left out")
+    parser.add_argument("--near-duplicate-threshold", type=float, metavar="SIMILARITY",
+                        help="Reuse classifications of near-duplicate chunks (e.g. 0.9)")
+    args = parser.parse_args()
+
+    run_pipeline(args)
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import checkpoint_journal
+from json_stream import write_json_array
+
+DEFAULT_SHARD_DIR = "shards"
+MANIFEST_FILE = "manifest.json"
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def shard_paths(shard_dir, shard_number):
+    """
+    Returns (chunk_file, output_file) of a shard. The output's journal is the shard's checkpoint.
+    """
+    stem = os.path.join(shard_dir, f"shard-{shard_number:03d}")
+    return stem + ".chunks.json", stem + ".classified.json"
+
+def plan_shards(chunks, shard_count):
+    """
+    Splits the chunk list into at most shard_count contiguous shards of roughly equal size.
+    Shards only end on a page boundary, so a page is never split between two workers.
+    Returns one {"shard", "offset", "count", "first_page", "last_page"} entry per shard.
+    """
+    target = -(-len(chunks) // max(1, shard_count))
+    shards, start = [], 0
+    for index, chunk in enumerate(chunks):
+        is_last = index + 1 == len(chunks)
+        page_ends = is_last or chunks[index + 1]["metadata"]["page_number"] != chunk["metadata"]["page_number"]
+        if is_last or (page_ends and index + 1 - start >= target and len(shards) < shard_count - 1):
+            shards.append({
+                "shard": len(shards),
+                "offset": start,
+                "count": index + 1 - start,
+                "first_page": chunks[start]["metadata"]["page_number"],
+                "last_page": chunk["metadata"]["page_number"],
+            })
+            start = index + 1
+    return shards
+
+def load_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def split_catalog(chunk_file, shard_dir, shard_count, force=False):
+    """
+    Writes each shard's chunks and a manifest recording the shard offsets into chunk_file.
+    Refuses to replace an existing plan, since that would orphan the shards' checkpoints.
+    """
+    manifest_file = os.path.join(shard_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_file) and not force:
+        raise FileExistsError(f"{manifest_file} already exists; pass --force to re-plan and discard its checkpoints")
+
+    with open(chunk_file, "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    shards = plan_shards(chunks, shard_count)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    for shard in shards:
+        shard_chunk_file, output_file = shard_paths(shard_dir, shard["shard"])
+        with open(shard_chunk_file, "w", encoding="utf-8") as f:
+            json.dump(chunks[shard["offset"]:shard["offset"] + shard["count"]], f, ensure_ascii=False)
+        for stale in (output_file, checkpoint_journal.journal_path(output_file)):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    manifest = {
+        "chunk_file": os.path.abspath(chunk_file),
+        "chunk_file_sha256": file_hash(chunk_file),
+        "total_chunks": len(chunks),
+        "shards": shards,
+    }
+    with open(manifest_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+
+    for shard in shards:
+        print(f"🧩 Shard {shard['shard']}: chunks {shard['offset'] + 1}-{shard['offset'] + shard['count']} "
+              f"(pages {shard['first_page']}-{shard['last_page']})")
+    print(f"✅ Planned {len(shards)} shards in {manifest_file}")
+    return manifest
+
+def shard_results(shard_dir, shard_number):
+    """
+    Returns the chunks a shard has classified so far. The journal is read first, so results are
+    complete even if the worker was killed before compacting its output.
+    """
+    _, output_file = shard_paths(shard_dir, shard_number)
+    journal = checkpoint_journal.journal_path(output_file)
+    if os.path.exists(journal):
+        return checkpoint_journal.replay(journal)
+    if os.path.exists(output_file):
+        with open(output_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return []
+
+def shard_status(shard_dir):
+    """
+    Prints how far each shard has got and returns the numbers of shards that are not complete.
+    """
+    incomplete = []
+    for shard in load_manifest(shard_dir)["shards"]:
+        done = len(shard_results(shard_dir, shard["shard"]))
+        mark = "✅" if done >= shard["count"] else "⏳"
+        print(f"{mark} Shard {shard['shard']} (pages {shard['first_page']}-{shard['last_page']}): "
+              f"{done}/{shard['count']} chunks")
+        if done < shard["count"]:
+            incomplete.append(shard["shard"])
+    return incomplete
+
+def work_shard(shard_dir, shard_number, header_file, rate_share=1, restart=False, use_async=False,
+               max_in_flight=8, pack_size=1, use_cascade=False, structured=False, near_duplicate_threshold=None,
+               **lookup_options):
+    """
+    Classifies one shard in this process. It resumes from the shard's own journal, and touches no
+    other shard's files. rate_share divides the scheduler's per-minute budgets among the workers
+    that run at the same time. Near-duplicates are only looked up within the shard.
+    """
+    import classification_agent_new as agent
+    from llm_scheduler import TokenBucket
+
+    chunk_file, output_file = shard_paths(shard_dir, shard_number)
+    if restart:
+        for path in (output_file, checkpoint_journal.journal_path(output_file)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    if rate_share > 1:
+        agent.scheduler.request_bucket = TokenBucket(agent.scheduler.request_bucket.capacity / rate_share)
+        agent.scheduler.token_bucket = TokenBucket(agent.scheduler.token_bucket.capacity / rate_share)
+
+    if use_async:
+        asyncio.run(agent.classify_chunks_with_llm_async(chunk_file, header_file, output_file, max_in_flight,
+                                                         pack_size, use_cascade, structured,
+                                                         near_duplicate_threshold, **lookup_options))
+    else:
+        agent.classify_chunks_with_llm(chunk_file, header_file, output_file, pack_size, use_cascade, structured,
+                                       near_duplicate_threshold, **lookup_options)
+
+def run_shards(shard_dir, shard_numbers, workers, worker_args):
+    """
+    Runs each listed shard in its own worker process, at most `workers` at a time, and returns
+    the numbers of the shards whose worker failed. Worker output goes to shard-NNN.log.
+    """
+    pending = list(shard_numbers)
+    running, failed = {}, []
+    rate_share = min(workers, len(pending)) or 1
+
+    while pending or running:
+        while pending and len(running) < workers:
+            shard_number = pending.pop(0)
+            log_file = open(os.path.join(shard_dir, f"shard-{shard_number:03d}.log"), "a", encoding="utf-8")
+            command = [sys.executable, os.path.abspath(__file__), "--dir", shard_dir, "work", str(shard_number),
+                       "--rate-share", str(rate_share), *worker_args]
+            running[shard_number] = (subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT), log_file)
+            print(f"🚀 Started shard {shard_number}")
+
+        for shard_number, (process, log_file) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log_file.close()
+            del running[shard_number]
+            if process.returncode == 0:
+                print(f"✅ Shard {shard_number} finished")
+            else:
+                failed.append(shard_number)
+                print(f"❌ Shard {shard_number} failed with exit code {process.returncode}; see its log")
+        if running:
+            time.sleep(0.5)
+    return sorted(failed)
+
+def merge_shards(shard_dir, output_file, allow_missing=False):
+    """
+    Reassembles the shard results into one output in global chunk_number order. Every chunk is
+    checked against the catalog it was planned from: chunks classified twice, chunks whose id does
+    not match the catalog at that position, and catalog chunks no shard classified are reported.
+    Raises ValueError on duplicates or mismatches, and on missing chunks unless allow_missing.
+    """
+    manifest = load_manifest(shard_dir)
+    if file_hash(manifest["chunk_file"]) != manifest["chunk_file_sha256"]:
+        print(f"⚠️ {manifest['chunk_file']} changed after the shards were planned; checking against the shard inputs")
+
+    duplicates, mismatched, missing = [], [], []
+
+    def merged_chunks():
+        for shard in manifest["shards"]:
+            chunk_file, _ = shard_paths(shard_dir, shard["shard"])
+            with open(chunk_file, "r", encoding="utf-8") as f:
+                expected_ids = [chunk["id"] for chunk in json.load(f)]
+
+            by_number = {}
+            for chunk in shard_results(shard_dir, shard["shard"]):
+                local_number = chunk["metadata"]["chunk_number"]
+                global_number = shard["offset"] + local_number
+                if not 1 <= local_number <= shard["count"] or chunk["id"] != expected_ids[local_number - 1]:
+                    mismatched.append(global_number)
+                elif local_number in by_number:
+                    duplicates.append(global_number)
+                else:
+                    by_number[local_number] = chunk
+
+            for local_number in range(1, shard["count"] + 1):
+                chunk = by_number.get(local_number)
+                if chunk is None:
+                    missing.append(shard["offset"] + local_number)
+                    continue
+                chunk["metadata"]["chunk_number"] = shard["offset"] + local_number
+                if "last_used_header_index" in chunk["metadata"]:  # The agent records the chunk index here
+                    chunk["metadata"]["last_used_header_index"] += shard["offset"]
+                yield chunk
+
+    tmp_file = output_file + ".tmp"
+    count = write_json_array(merged_chunks(), tmp_file, ensure_ascii=True)  # Same bytes as a single-process run
+
+    for label, numbers in (("classified more than once", duplicates), ("not matching the catalog", mismatched),
+                           ("missing", missing)):
+        if numbers:
+            preview = ", ".join(f"#{number}" for number in numbers[:20]) + (" ..." if len(numbers) > 20 else "")
+            print(f"⚠️ {len(numbers)} chunks {label}: {preview}")
+    if duplicates or mismatched or (missing and not allow_missing):
+        os.remove(tmp_file)
+        raise ValueError(f"Shards in {shard_dir} did not merge cleanly")
+
+    os.replace(tmp_file, output_file)
+    print(f"✅ Merged {count}/{manifest['total_chunks']} chunks from {len(manifest['shards'])} shards into {output_file}")
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify catalog chunks in page-range shards with parallel workers.")
+    parser.add_argument("--dir", default=DEFAULT_SHARD_DIR, help="Shard directory (may be on a shared drive)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Split the catalog into shards by page range")
+    plan_parser.add_argument("--shards", type=int, required=True)
+    plan_parser.add_argument("--chunk-file", default="catalog.json")
+    plan_parser.add_argument("--force", action="store_true", help="Replace an existing plan and its checkpoints")
+
+    subparsers.add_parser("status", help="Show the progress of each shard")
+
+    worker_options = argparse.ArgumentParser(add_help=False)
+    worker_options.add_argument("--header-file", default="toc_headers_with_page_ranges.json")
+    worker_options.add_argument("--async", dest="use_async", action="store_true")
+    worker_options.add_argument("--max-in-flight", type=int, default=8)
+    worker_options.add_argument("--pack-size", type=int, default=1)
+    worker_options.add_argument("--no-fast-path", dest="use_fast_path", action="store_false")
+    worker_options.add_argument("--cascade", action="store_true")
+    worker_options.add_argument("--structured", action="store_true")
+    worker_options.add_argument("--near-duplicate-threshold", type=float, metavar="SIMILARITY",
+                                help="Reuse classifications of near-duplicate chunks (e.g. 0.9)")
+    worker_options.add_argument("--previous-output", metavar="OUTPUT_FILE")
+
+    run_parser = subparsers.add_parser("run", parents=[worker_options], help="Run shards in worker processes")
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Shards processed at the same time")
+    run_parser.add_argument("--only", type=int, nargs="+", metavar="SHARD",
+                            help="Run only these shards (default: every shard that is not complete)")
+
+    work_parser = subparsers.add_parser("work", parents=[worker_options], help="Process one shard in this process")
+    work_parser.add_argument("shard", type=int)
+    work_parser.add_argument("--rate-share", type=int, default=1,
+                             help="Number of workers sharing the API rate limits")
+    work_parser.add_argument("--restart", action="store_true", help="Discard the shard's checkpoint first")
+
+    merge_parser = subparsers.add_parser("merge", help="Merge shard results in chunk order")
+    merge_parser.add_argument("--output", default="classified_catalog_agent_new.json")
+    merge_parser.add_argument("--allow-missing", action="store_true",
+                              help="Write the merged output even if some chunks were not classified")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        split_catalog(args.chunk_file, args.dir, args.shards, args.force)
+    elif args.command == "status":
+        shard_status(args.dir)
+    elif args.command == "work":
+        work_shard(args.dir, args.shard, args.header_file, args.rate_share, args.restart, args.use_async,
+                   args.max_in_flight, args.pack_size, args.cascade, args.structured, args.near_duplicate_threshold,
+                   use_fast_path=args.use_fast_path, previous_output=args.previous_output)
+    elif args.command == "run":
+        worker_args = ["--header-file", args.header_file, "--max-in-flight", str(args.max_in_flight),
+                       "--pack-size", str(args.pack_size)]
+        worker_args += [flag for flag, enabled in (("--async", args.use_async), ("--no-fast-path", not args.use_fast_path),
+                                                   ("--cascade", args.cascade), ("--structured", args.structured))
+                        if enabled]
+        if args.previous_output:
+            worker_args += ["--previous-output", args.previous_output]
+        if args.near_duplicate_threshold:
+            worker_args += ["--near-duplicate-threshold", str(args.near_duplicate_threshold)]
+        shard_numbers = args.only if args.only is not None else shard_status(args.dir)
+        failed = run_shards(args.dir, shard_numbers, args.workers, worker_args)
+        if failed:
+            print(f"❌ Failed shards: {failed}. Rerun them with: python sharded_run.py run --only "
+                  + " ".join(map(str, failed)))
+            sys.exit(1)
+        # A worker exits cleanly even when some of its requests were dead-lettered
+        incomplete = shard_status(args.dir)
+        if incomplete:
+            print(f"⚠️ Shards {incomplete} are missing chunks. Rerun them to retry the missing chunks: "
+                  "python sharded_run.py run")
+            sys.exit(1)
+        print("🎉 All shards finished; merge them with: python sharded_run.py merge")
+    elif args.command == "merge":
+        try:
+            merge_shards(args.dir, args.output, args.allow_missing)
+        except ValueError as e:
+            print(f"❌ {e}. `python sharded_run.py run` retries missing chunks; a shard with duplicated or "
+                  "mismatched chunks needs `python sharded_run.py work SHARD --restart`.")
+            sys.exit(1)
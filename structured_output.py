@@ -0,0 +1,43 @@
+import json
+
+# Schema-constrained header selection shared by classification_agent.py and classification_agent_new.py
+
+def selection_response_format(headers):
+    """
+    JSON schema for a structured reply: a non-empty list of header numbers, each one of the candidates.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "header_selection",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "header_ids": {
+                        "type": "array",
+                        "items": {"type": "integer", "enum": list(range(1, len(headers) + 1))},
+                        "minItems": 1,
+                    },
+                },
+                "required": ["header_ids"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+def parse_header_ids(raw_response, headers):
+    """
+    Validates a structured reply ({"header_ids": [...]}) locally and returns its 1-based header
+    numbers without repeats, or None if it is not valid JSON, selects nothing, or names a number
+    outside the candidate list. The schema should rule these out, but replies are not trusted.
+    """
+    try:
+        numbers = json.loads(raw_response)["header_ids"]
+    except (json.JSONDecodeError, TypeError, KeyError):
+        return None
+    if not isinstance(numbers, list) or not numbers:
+        return None
+    if any(type(number) is not int or not 1 <= number <= len(headers) for number in numbers):
+        return None
+    return list(dict.fromkeys(numbers))
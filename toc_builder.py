@@ -0,0 +1,125 @@
+import argparse
+import hashlib
+import json
+import os
+
+import fitz  # PyMuPDF
+
+from metrics import metrics
+
+TOC_CACHE_FILE = "toc_cache.json"
+
+def pdf_content_hash(pdf_path):
+    """
+    SHA-256 of the PDF bytes, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract_toc(pdf_path):
+    """Extracts the Table of Contents (TOC) from the PDF."""
+    metrics.record_file(pdf_path, "read")
+    with metrics.stage("extract_toc"), fitz.open(pdf_path) as doc:
+        toc = doc.get_toc()
+    return [{"level": level, "title": title, "page": page} for level, title, page in toc]
+
+def load_toc(pdf_path, cache_file=TOC_CACHE_FILE):
+    """
+    Returns the PDF's TOC, parsing the PDF only when the cache holds no TOC for its exact content.
+    """
+    pdf_hash = pdf_content_hash(pdf_path)
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("pdf_sha256") == pdf_hash:
+            print(f"🗄️ TOC for {pdf_path} loaded from {cache_file}")
+            return cached["toc"]
+
+    toc = extract_toc(pdf_path)
+    if cache_file:
+        tmp_path = cache_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pdf_sha256": pdf_hash, "pdf_path": pdf_path, "toc": toc}, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_file)
+    return toc
+
+def toc_headers(toc):
+    """
+    Builds the hierarchical header path of every TOC entry, keeping its level, title and page.
+    """
+    headers = []
+    stack = []  # Track current parent headers
+
+    for entry in toc:
+        level, title = entry["level"], entry["title"]
+
+        # Remove deeper levels if necessary
+        while len(stack) >= level:
+            stack.pop()
+
+        # Add the current title to the hierarchy
+        stack.append(title)
+
+        headers.append({"header": ", ".join(stack), "level": level, "title": title, "page": entry["page"]})
+
+    return headers
+
+def toc_page_ranges(headers):
+    """
+    Gives each header a (start, end) page range that runs up to the page where the next header starts.
+    """
+    ranges = []
+    for i, entry in enumerate(headers):
+        start_page = entry["page"]
+        next_start_page = headers[i + 1]["page"] if i + 1 < len(headers) else None
+
+        # Assign range: Current start page → Page before the next section starts
+        end_page = next_start_page if next_start_page and next_start_page > start_page else start_page  # Default to single-page section if no next header
+
+        ranged = {key: value for key, value in entry.items() if key != "page"}
+        ranged["start"], ranged["end"] = start_page, end_page
+        ranges.append(ranged)
+    return ranges
+
+def write_toc_views(toc, header_txt_path="toc_headers.txt", pages_json_path="toc_headers_with_pages.json",
+                    ranges_json_path="toc_headers_with_page_ranges.json"):
+    """
+    Writes the three TOC views (header list, headers with start pages, headers with page ranges)
+    from one in-memory TOC. Pass None for a path to skip that view.
+    """
+    headers = toc_headers(toc)
+    if header_txt_path:
+        with open(header_txt_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(header["header"] for header in headers))
+    if pages_json_path:
+        with open(pages_json_path, "w", encoding="utf-8") as f:
+            json.dump(headers, f, indent=4)
+    if ranges_json_path:
+        with open(ranges_json_path, "w", encoding="utf-8") as f:
+            json.dump(toc_page_ranges(headers), f, indent=4)
+    for path in (header_txt_path, pages_json_path, ranges_json_path):
+        if path:
+            metrics.record_file(path, "written")
+    return headers
+
+def build_toc(pdf_path, cache_file=TOC_CACHE_FILE, **output_paths):
+    """
+    Reads the TOC once (or from the cache) and writes every TOC view used by the pipeline.
+    """
+    toc = load_toc(pdf_path, cache_file)
+    with metrics.stage("write_toc_views"):
+        headers = write_toc_views(toc, **output_paths)
+    print(f"✅ {len(headers)} TOC headers saved from {pdf_path}")
+    return headers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the TOC header files from a catalog PDF.")
+    parser.add_argument("pdf_path", nargs="?", default="catalog.pdf")
+    parser.add_argument("--cache-file", default=TOC_CACHE_FILE,
+                        help="TOC cache keyed by the PDF's content hash")
+    args = parser.parse_args()
+
+    build_toc(args.pdf_path, args.cache_file)
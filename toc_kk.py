@@ -1,48 +1,25 @@
-import fitz  # PyMuPDF
 import json
 
-def extract_toc(pdf_path):
-    """Extracts the Table of Contents (TOC) from the PDF."""
-    doc = fitz.open(pdf_path)
-    toc = doc.get_toc()
-    return [{"level": level, "title": title, "page": page} for level, title, page in toc]
+from toc_builder import load_toc, toc_headers
 
 def generate_toc_list_with_pages(toc):
-    """Generates a hierarchical list of headers with their page numbers."""
-    header_list = []
-    stack = []  # Track current parent headers
+    """Generates a hierarchical list of headers with their level, title and page number."""
+    return toc_headers(toc)
 
-    for entry in toc:
-        level, title, page = entry["level"], entry["title"], entry["page"]
+if __name__ == "__main__":
+    # Path to your PDF
+    pdf_path = "catalog.pdf"
+    output_json_path = "toc_headers_with_pages.json"
 
-        # Remove deeper levels if necessary
-        while len(stack) >= level:
-            stack.pop()
+    # Extract TOC (from toc_cache.json when the PDF is unchanged)
+    toc = load_toc(pdf_path)
 
-        # Add the current title to the hierarchy
-        stack.append(title)
+    # Generate hierarchical header list with pages
+    header_list_with_pages = generate_toc_list_with_pages(toc)
 
-        # Store the formatted header path along with page number
-        header_list.append({
-            "header": ", ".join(stack),
-            "page": page
-        })
+    # Save to JSON file
+    with open(output_json_path, "w", encoding="utf-8") as f:
+        json.dump(header_list_with_pages, f, indent=4)
 
-    return header_list
-
-# Path to your PDF
-pdf_path = "catalog.pdf"
-output_json_path = "toc_headers_with_pages.json"
-
-# Extract TOC
-toc = extract_toc(pdf_path)
-
-# Generate hierarchical header list with pages
-header_list_with_pages = generate_toc_list_with_pages(toc)
-
-# Save to JSON file
-with open(output_json_path, "w", encoding="utf-8") as f:
-    json.dump(header_list_with_pages, f, indent=4)
-
-# Print output
-print(f"✅ TOC headers with pages saved to {output_json_path}")
+    # Print output
+    print(f"✅ TOC headers with pages saved to {output_json_path}")